@@ -6,11 +6,15 @@ posted ArUco markers.
 from archimedes_whiteboard.board_region.board_region import (
     crop_image_to_markers,
     get_all_markers,
+    get_marker_crop,
+    get_marker_length,
+    get_normalizing_transform,
     normalize_image
 )
 
 
-def get_whiteboard_region_normal(whiteboard_image):
+def get_whiteboard_region_normal(whiteboard_image, transform=None, scale=1,
+                                 crop=None):
     '''
     Get a cropped and normalized view of the designated smart region.
 
@@ -22,20 +26,31 @@ def get_whiteboard_region_normal(whiteboard_image):
     ----------
     whiteboard_image : opencv bgr image
         A whiteboard image with four ArUco markers.
+    transform (optional) : numpy array or None
+        If not None, the normalizing transform to use instead of the one
+        found from the markers.
+    scale (optional) : positive number
+        Resolution of the normalized view relative to the default.
+    crop (optional) : 2-tuple or None
+        If not None, the crop from get_marker_crop to use instead of the one
+        found from the markers.
 
     Returns
     -------
     opencv bgr image
         The image normalized and cropped to the designated region.
     '''
-    normal = normalize_image(whiteboard_image)
-    cropped = crop_image_to_markers(normal)
+    normal = normalize_image(whiteboard_image, transform, scale)
+    cropped = crop_image_to_markers(normal, crop, scale)
     return cropped
 
 
 __all__ = [
     'get_whiteboard_region_normal',
     'get_all_markers',
+    'get_marker_crop',
+    'get_marker_length',
+    'get_normalizing_transform',
     'normalize_image',
     'crop_image_to_markers'
 ]
@@ -57,12 +57,11 @@ def get_marker_inverse_transform(corners):
     return cv2.getPerspectiveTransform(corners, new_corners)
 
 
-def normalize_image(image):
+def get_normalizing_transform(image):
     '''
-    Get a "head-on" view of an image with multiple visible markers.
+    Get the transform to a "head-on" view of an image with visible markers.
 
-    Approximately inverts the camera's perspective to the whiteboard using
-    the average inverse transforms of at least two visible markers.
+    Averages the inverse transforms of all visible markers.
 
     Parameters
     ----------
@@ -71,13 +70,13 @@ def normalize_image(image):
 
     Returns
     -------
-    opencv bgr image
-        A head-on view of the image.
+    numpy array or None
+        A 3x3 perspective transform, or None if no markers are visible.
     '''
     markers = get_all_markers(image)
     corners = markers[0]
-    width = len(image[0])
-    height = len(image)
+    if len(corners) == 0:
+        return None
 
     # Average the perspective inverse transforms for all four corner markers
     transforms = [get_marker_inverse_transform(corner[0])
@@ -88,10 +87,103 @@ def normalize_image(image):
         avg_transform += transform
     avg_transform /= len(transforms)
 
-    return cv2.warpPerspective(image, avg_transform, (width * 2, height * 2))
+    return avg_transform
+
+
+def normalize_image(image, transform=None, scale=1):
+    '''
+    Get a "head-on" view of an image with multiple visible markers.
+
+    Approximately inverts the camera's perspective to the whiteboard using
+    the average inverse transforms of at least two visible markers.
+
+    Parameters
+    ----------
+    image : opencv bgr image
+        The image.
+    transform (optional) : numpy array or None
+        If not None, a transform from get_normalizing_transform to use instead
+        of searching the image for markers, e.g. one restored from a
+        checkpoint.
+    scale (optional) : positive number
+        Resolution of the head-on view relative to the default, which is
+        twice the input size.
+
+    Returns
+    -------
+    opencv bgr image
+        A head-on view of the image.
+    '''
+    width = len(image[0])
+    height = len(image)
+
+    if transform is None:
+        transform = get_normalizing_transform(image)
 
+    if scale != 1:
+        transform = np.diag([scale, scale, 1]).dot(transform)
 
-def crop_image_to_markers(image):
+    size = (int(width * 2 * scale), int(height * 2 * scale))
+    return cv2.warpPerspective(image, transform, size)
+
+
+def get_marker_crop(image, scale=1):
+    '''
+    Find the outer rectangular region of the ArUco markers in an image.
+
+    Parameters
+    ----------
+    image : opencv bgr image
+        A normalized image with multiple aruco markers.
+    scale (optional) : positive number
+        Resolution of the image relative to the default normalized view.
+        The crop is returned at the default resolution.
+
+    Returns
+    -------
+    2-tuple or None
+        The region as (left, top, right, bottom), and a list of each
+        marker's rectangle as (left, top, right, bottom), or None if no
+        markers are visible.
+    '''
+    markers = get_all_markers(image)
+    markers_corners = markers[0]
+    if len(markers_corners) == 0:
+        return None
+
+    points = np.concatenate([corners[0] for corners in markers_corners])
+    points = points / scale
+    bounds = (int(points[:, 0].min()), int(points[:, 1].min()),
+              int(points[:, 0].max()), int(points[:, 1].max()))
+    rectangles = [(int(corners[0][0][0] / scale),
+                   int(corners[0][0][1] / scale),
+                   int(corners[0][2][0] / scale),
+                   int(corners[0][2][1] / scale))
+                  for corners in markers_corners]
+    return bounds, rectangles
+
+
+def get_marker_length(crop):
+    '''
+    Get the side length of the markers of a normalized board.
+
+    Parameters
+    ----------
+    crop : 2-tuple
+        A crop from get_marker_crop.
+
+    Returns
+    -------
+    number
+        Mean side length of the markers at the default resolution (pixels).
+    '''
+    _, rectangles = crop
+    sides = [abs(right - left) for left, _, right, _ in rectangles] + \
+        [abs(bottom - top) for _, top, _, bottom in rectangles]
+    return sum(sides) / len(sides)
+
+
+def crop_image_to_markers(image, crop=None, scale=1):
     '''
     Crop an image with multiple ArUco markers to the outer rectangular region
     of those markers and white out the markers.
@@ -104,31 +196,35 @@ def crop_image_to_markers(image):
     ----------
     image : opencv bgr image
         An image with multiple aruco markers in a rectangular region.
+    crop (optional) : 2-tuple or None
+        If not None, a crop from get_marker_crop to use instead of searching
+        the image for markers, e.g. one restored from a checkpoint.
+    scale (optional) : positive number
+        Resolution of the image relative to the default normalized view.
 
     Returns
     -------
     opencv bgr image
         The image cropped to the rectangular region outside the markers.
-    '''
-    markers = get_all_markers(image)
-    markers_corners = markers[0]
 
-    corners_x, corners_y = [], []
-    for corners in markers_corners:
-        for corner in corners[0]:
-            corners_x.append(corner[0])
-            corners_y.append(corner[1])
+    Raises
+    ------
+    ValueError
+        If no crop is given and no markers are visible.
+    '''
+    if crop is None:
+        crop = get_marker_crop(image, scale)
+        if crop is None:
+            raise ValueError('No ArUco markers visible')
+    (left_edge, top_edge, right_edge, bottom_edge), rectangles = crop
 
+    for left, top, right, bottom in rectangles:
         # White out marker
         image = cv2.rectangle(image,
-                              (corners[0][0][0], corners[0][0][1]),
-                              (corners[0][2][0], corners[0][2][1]),
+                              (int(left * scale), int(top * scale)),
+                              (int(right * scale), int(bottom * scale)),
                               (255, 255, 255),
                               thickness=-1)  # Indicates fill
 
-    left_edge = int(min(corners_x))
-    right_edge = int(max(corners_x))
-    top_edge = int(min(corners_y))
-    bottom_edge = int(max(corners_y))
-
-    return image[top_edge:bottom_edge, left_edge:right_edge]
+    return image[int(top_edge * scale):int(bottom_edge * scale),
+                 int(left_edge * scale):int(right_edge * scale)]
@@ -0,0 +1,296 @@
+'''
+Crash-safe checkpointing of pipeline state for fast restarts.
+
+Saves each command's blocked regions and board scale, and the board's
+normalizing transform and marker crop, in a compact binary file replaced
+atomically so that a crash mid-write leaves the previous checkpoint intact.
+With the transform and crop restored, frames can be normalized without
+searching for markers.
+
+File format (little-endian):
+    header : magic b'AWCP', uint8 version, uint8 flags, uint16 commands
+    transform : 9 float64, only if flags bit 0 is set
+    crop : 4 int32 region bounds, uint8 markers, then 4 int32 bounds per
+        marker, only if flags bit 1 is set
+    per command : uint8 tag length, utf-8 tag, float64 normal scale,
+        uint16 regions
+    per region : 8 int32 corner coordinates at the command's normal scale,
+        int32 cooldown frames remaining, int32 clear frames remaining
+'''
+
+import os
+import struct
+import tempfile
+import time
+import numpy as np
+
+
+MAGIC = b'AWCP'
+VERSION = 3
+HAS_TRANSFORM = 1
+HAS_CROP = 2
+
+_HEADER = struct.Struct('<4sBBH')
+_TRANSFORM = struct.Struct('<9d')
+_BOUNDS = struct.Struct('<4i')
+_MARKER_COUNT = struct.Struct('<B')
+_TAG_LENGTH = struct.Struct('<B')
+_SCALE = struct.Struct('<d')
+_REGION_COUNT = struct.Struct('<H')
+_REGION = struct.Struct('<10i')
+
+
+def _encode(commands, transform, crop):
+    '''
+    Encode pipeline state in the checkpoint format.
+
+    Parameters
+    ----------
+    commands : list of Command
+        The configured commands, in config order.
+    transform : numpy array or None
+        The board's normalizing transform, if known.
+    crop : 2-tuple or None
+        The board's marker crop from get_marker_crop, if known.
+
+    Returns
+    -------
+    bytes
+        The encoded checkpoint.
+    '''
+    flags = (HAS_TRANSFORM if transform is not None else 0) | \
+        (HAS_CROP if crop is not None else 0)
+    parts = [_HEADER.pack(MAGIC, VERSION, flags, len(commands))]
+    if transform is not None:
+        parts.append(_TRANSFORM.pack(*np.asarray(transform).ravel()))
+    if crop is not None:
+        bounds, markers = crop
+        parts.append(_BOUNDS.pack(*(int(value) for value in bounds)))
+        parts.append(_MARKER_COUNT.pack(len(markers)))
+        for marker in markers:
+            parts.append(_BOUNDS.pack(*(int(value) for value in marker)))
+
+    for command in commands:
+        tag = command.yaml_tag.encode('utf-8')
+        state = command.get_state()
+        parts.append(_TAG_LENGTH.pack(len(tag)) + tag)
+        parts.append(_SCALE.pack(command.normal_scale))
+        parts.append(_REGION_COUNT.pack(len(state)))
+        for corners, cooldown_remaining, clear_remaining in state:
+            coordinates = [int(value) for corner in corners
+                           for value in corner]
+            parts.append(_REGION.pack(*coordinates, int(cooldown_remaining),
+                                      int(clear_remaining)))
+
+    return b''.join(parts)
+
+
+def _decode(data):
+    '''
+    Decode a checkpoint.
+
+    Parameters
+    ----------
+    data : bytes
+        The encoded checkpoint.
+
+    Returns
+    -------
+    3-tuple
+        The transform (or None), the crop (or None), and a list of
+        (tag, normal scale, state) for each command, where state is as
+        returned by Command.get_state.
+
+    Raises
+    ------
+    ValueError
+        If the data is not a valid checkpoint.
+    '''
+    try:
+        magic, version, flags, command_count = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a version {} checkpoint'.format(VERSION))
+        offset = _HEADER.size
+
+        transform = None
+        if flags & HAS_TRANSFORM:
+            transform = np.array(_TRANSFORM.unpack_from(data, offset))
+            transform = transform.reshape(3, 3)
+            offset += _TRANSFORM.size
+
+        crop = None
+        if flags & HAS_CROP:
+            bounds = _BOUNDS.unpack_from(data, offset)
+            offset += _BOUNDS.size
+            marker_count, = _MARKER_COUNT.unpack_from(data, offset)
+            offset += _MARKER_COUNT.size
+            markers = []
+            for _ in range(marker_count):
+                markers.append(_BOUNDS.unpack_from(data, offset))
+                offset += _BOUNDS.size
+            crop = (bounds, markers)
+
+        commands = []
+        for _ in range(command_count):
+            tag_length, = _TAG_LENGTH.unpack_from(data, offset)
+            offset += _TAG_LENGTH.size
+            tag = data[offset:offset + tag_length].decode('utf-8')
+            offset += tag_length
+            normal_scale, = _SCALE.unpack_from(data, offset)
+            offset += _SCALE.size
+
+            region_count, = _REGION_COUNT.unpack_from(data, offset)
+            offset += _REGION_COUNT.size
+            state = []
+            for _ in range(region_count):
+                values = _REGION.unpack_from(data, offset)
+                offset += _REGION.size
+                corners = list(zip(values[0:8:2], values[1:8:2]))
+                state.append((corners, values[8], values[9]))
+            commands.append((tag, normal_scale, state))
+    except (struct.error, UnicodeDecodeError) as error:
+        raise ValueError('Truncated or corrupt checkpoint') from error
+
+    return transform, crop, commands
+
+
+def save_checkpoint(path, commands, transform=None, crop=None):
+    '''
+    Atomically save pipeline state to a file.
+
+    Parameters
+    ----------
+    path : str path to a file
+        The checkpoint file. Replaced only once the new state is on disk.
+    commands : list of Command
+        The configured commands, in config order.
+    transform (optional) : numpy array or None
+        The board's normalizing transform, if known.
+    crop (optional) : 2-tuple or None
+        The board's marker crop from get_marker_crop, if known.
+    '''
+    data = _encode(commands, transform, crop)
+    directory = os.path.dirname(os.path.abspath(path))
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    # Make the rename itself durable
+    if hasattr(os, 'O_DIRECTORY'):
+        directory_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+
+def load_checkpoint(path, commands):
+    '''
+    Restore pipeline state saved by save_checkpoint.
+
+    Commands are matched to saved state by position and YAML tag; commands
+    that do not match, e.g. after editing the config, start fresh. Matched
+    commands get back the normal_scale their regions were saved at.
+
+    Parameters
+    ----------
+    path : str path to a file
+        The checkpoint file.
+    commands : list of Command
+        The configured commands, in config order.
+
+    Returns
+    -------
+    2-tuple
+        The saved normalizing transform and marker crop, each None if there
+        is none or the file does not exist.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid checkpoint.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None, None
+
+    transform, crop, saved = _decode(data)
+    for command, (tag, normal_scale, state) in zip(commands, saved):
+        if command.yaml_tag == tag:
+            command.normal_scale = normal_scale
+            command.set_state(state)
+
+    return transform, crop
+
+
+class Checkpointer():
+    '''
+    Saves pipeline state periodically.
+
+    Parameters
+    ----------
+    path : str path to a file
+        The checkpoint file.
+    interval (optional) : positive number
+        Minimum number of seconds between checkpoints.
+    '''
+
+    def __init__(self, path, interval=10):
+        self._path = path
+        self._interval = interval
+        self._last_save = time.monotonic()
+
+    def restore(self, commands):
+        '''
+        Restore pipeline state from the checkpoint file, if any.
+
+        Parameters
+        ----------
+        commands : list of Command
+            The configured commands, in config order.
+
+        Returns
+        -------
+        2-tuple
+            The saved normalizing transform and marker crop, each None if
+            there is none.
+        '''
+        return load_checkpoint(self._path, commands)
+
+    def update(self, commands, transform=None, crop=None, force=False):
+        '''
+        Save pipeline state if the interval has passed since the last save.
+
+        Parameters
+        ----------
+        commands : list of Command
+            The configured commands, in config order.
+        transform (optional) : numpy array or None
+            The board's normalizing transform, if known.
+        crop (optional) : 2-tuple or None
+            The board's marker crop from get_marker_crop, if known.
+        force (optional) : bool
+            If True, save even if the interval has not passed, e.g. on exit.
+
+        Returns
+        -------
+        bool
+            True if a checkpoint was saved.
+        '''
+        now = time.monotonic()
+        if not force and now - self._last_save < self._interval:
+            return False
+
+        save_checkpoint(self._path, commands, transform, crop)
+        self._last_save = now
+        return True
@@ -32,22 +32,25 @@ class Block_Region():
         Minimum saturation to detect the color.
     min_value (optional) : number
         Minimum value to detect the color.
+    bounds (optional) : 4-tuple of ints or None
+        Bounding box of the corners as (x min, y min, x max, y max), if
+        already computed.
     '''
 
     def __init__(self, corners, target_hue,
                  clear_frames=5, clear_pixels=10, cooldown_frames=30,
-                 tol_hue=35, min_saturation=10, min_value=50):
+                 tol_hue=35, min_saturation=10, min_value=50, bounds=None):
         self._corners = corners
-        x_vals, y_vals = zip(*corners)
-        self._x_min = min(x_vals)
-        self._x_max = max(x_vals)
-        self._y_min = min(y_vals)
-        self._y_max = max(y_vals)
+        if bounds is None:
+            x_vals, y_vals = zip(*corners)
+            bounds = (min(x_vals), min(y_vals), max(x_vals), max(y_vals))
+        self._x_min, self._y_min, self._x_max, self._y_max = bounds
 
         self._clear_frames = clear_frames
         self._clear_pixels = clear_pixels
         self._cooldown_frames_remaining = cooldown_frames
         self._clear_frames_remaining = clear_frames
+        self._pending = False
 
         # Color properties match command
         self._target_hue = target_hue
@@ -55,7 +58,7 @@ class Block_Region():
         self._min_saturation = min_saturation
         self._min_value = min_value
 
-    def _are_corners_clear(self, image):
+    def _are_corners_clear(self, image, filtered=None):
         '''
         Check if all corners in this image are clear.
 
@@ -63,14 +66,18 @@ class Block_Region():
         ----------
         image : opencv bgr image
             The input image.
+        filtered (optional) : opencv grayscale image or None
+            The input image already filtered to the target color, if
+            available.
 
         Returns
         -------
         bool
             True if all the corners in the image are white, False otherwise.
         '''
-        filtered = filter_to_color(image, self._target_hue, self._tol_hue,
-                                   self._min_saturation, self._min_value)
+        if filtered is None:
+            filtered = filter_to_color(image, self._target_hue, self._tol_hue,
+                                       self._min_saturation, self._min_value)
 
         for x, y in self._corners:
             if np.any(filtered[y - self._clear_pixels:y + self._clear_pixels,
@@ -79,7 +86,7 @@ class Block_Region():
 
         return True
 
-    def mask_region(self, image):
+    def mask_region(self, image, color=(255, 255, 255)):
         '''
         Given an image, return the image with the region blocked out in white.
 
@@ -87,6 +94,8 @@ class Block_Region():
         ----------
         image : opencv bgr image
             The input image.
+        color (optional) : color tuple or number
+            Color to block the region out with, e.g. 0 for a color mask.
 
         Returns
         -------
@@ -97,10 +106,10 @@ class Block_Region():
         fill = cv2.rectangle(image.copy(),
                              (self._x_min - c, self._y_min - c),
                              (self._x_max + c, self._y_max + c),
-                             (255, 255, 255), thickness=-1)
+                             color, thickness=-1)
         return fill
 
-    def update(self, image):
+    def update(self, image, filtered=None):
         '''
         Updates frame counters, checking image to see if the corners are clear.
 
@@ -108,14 +117,92 @@ class Block_Region():
         ----------
         image : opencv bgr image
             An image to check the corners of.
+        filtered (optional) : opencv grayscale image or None
+            The image already filtered to the target color, if available.
         '''
-        if self._are_corners_clear(image):
+        if self._are_corners_clear(image, filtered):
             self._clear_frames_remaining -= 1
         else:
             self._clear_frames_remaining = self._clear_frames
 
         self._cooldown_frames_remaining -= 1
 
+    def rescale(self, factor):
+        '''
+        Scale the region's coordinates, e.g. when the board resolution changes.
+
+        Parameters
+        ----------
+        factor : positive number
+            Ratio of the new board resolution to the old.
+        '''
+        self._corners = [(int(round(x * factor)), int(round(y * factor)))
+                         for x, y in self._corners]
+        x_vals, y_vals = zip(*self._corners)
+        self._x_min, self._y_min = min(x_vals), min(y_vals)
+        self._x_max, self._y_max = max(x_vals), max(y_vals)
+
+    def get_state(self):
+        '''
+        Get the state needed to restore this region after a restart.
+
+        Returns
+        -------
+        3-tuple
+            The corners, frames remaining in the cooldown, and clear frames
+            remaining before unblocking.
+        '''
+        return (self._corners, self._cooldown_frames_remaining,
+                self._clear_frames_remaining)
+
+    def set_counters(self, cooldown_frames_remaining, clear_frames_remaining):
+        '''
+        Restore the frame counters saved by get_state.
+
+        Parameters
+        ----------
+        cooldown_frames_remaining : int
+            Frames remaining in the cooldown.
+        clear_frames_remaining : int
+            Clear frames remaining before unblocking.
+        '''
+        self._cooldown_frames_remaining = cooldown_frames_remaining
+        self._clear_frames_remaining = clear_frames_remaining
+
+    def set_pending(self, pending):
+        '''
+        Mark whether the region is still waiting to be evaluated.
+
+        Parameters
+        ----------
+        pending : bool
+            True while the region's scheduled evaluation has not finished.
+        '''
+        self._pending = pending
+
+    def is_pending(self):
+        '''
+        Returns whether the region is still waiting to be evaluated.
+
+        Returns
+        -------
+        bool
+            True if the region's scheduled evaluation has not finished.
+        '''
+        return self._pending
+
+    def is_erased(self):
+        '''
+        Returns whether the corners have been clear for long enough to count
+        the region as erased, regardless of cooldown.
+
+        Returns
+        -------
+        bool
+            True if the region's box has been erased.
+        '''
+        return self._clear_frames_remaining <= 0
+
     def is_clear(self):
         '''
         Returns whether the region has been clear for long enough to unblock.
@@ -0,0 +1,431 @@
+'''
+Implements Box_Tracker class.
+'''
+
+import cv2
+import numpy as np
+from archimedes_whiteboard.commands.region_extraction import \
+    (get_box_arrays, get_box_mask, get_box_mask_halo)
+
+
+class Box_Tracker():
+    '''
+    Incremental rectangular box detector for a stream of frames.
+
+    Finds the same boxes as get_rectangular_boxes, but keeps the previous
+    frame's denoised mask, labelled connected components, and each
+    component's contour and rectangle. On each new frame, only the mask in
+    changed grid cells and the components touching changed mask pixels are
+    recomputed, so the cost scales with how much of the board changed.
+
+    Components whose bounding box is too small to hold a box are never
+    traced, and whether each box lies in another component's hole is cached
+    and only rechecked inside changed areas.
+
+    Parameters
+    ----------
+    max_dist_fraction (optional) : number in [0, 1]
+        Maximum distance the detected rectangle can be from the original
+        contour as a fraction of contour perimeter.
+    min_size (optional) : int
+        Minimum area of a rectangle to be detected (pixels).
+    blur_size (optional) : odd int
+        Size of gaussian blur to apply; used for denoising.
+    dilate_size (optional) : int
+        Size of dilation to apply; used for closing holes.
+    cell_size (optional) : positive int
+        Side length of the grid cells used to find changed areas (pixels).
+    max_dirty_fraction (optional) : number in [0, 1]
+        If more than this fraction of cells changed, recompute everything.
+    tile_size (optional) : positive int or None
+        If not None, denoise full recomputes in tiles of this size.
+    num_threads (optional) : positive int or None
+        Number of threads to use for tiled processing.
+    '''
+
+    def __init__(self, max_dist_fraction=0.05, min_size=1000, blur_size=21,
+                 dilate_size=5, cell_size=64, max_dirty_fraction=0.5,
+                 tile_size=None, num_threads=None):
+        self._max_dist_fraction = max_dist_fraction
+        self._min_size = min_size
+        self._blur_size = blur_size
+        self._dilate_size = dilate_size
+        self._cell_size = cell_size
+        self._max_dirty_fraction = max_dirty_fraction
+        self._tile_size = tile_size
+        self._num_threads = num_threads
+        self._halo = get_box_mask_halo(blur_size, dilate_size)
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget all cached state; the next update recomputes everything.
+        '''
+        self._filtered = None  # Last color-filtered frame
+        self._mask = None  # Last denoised mask
+        self._labels = None  # Component label of each mask pixel
+        self._components = {}  # Label -> (bounding box, contour, rectangle)
+        self._outlined = set()  # Labels of components with a contour
+        self._nested = {}  # Label of each box -> whether it is nested
+        self._next_label = 1
+
+    def _describe_component(self, component, x, y):
+        '''
+        Find the contour and rectangle of a single connected component.
+
+        Parameters
+        ----------
+        component : numpy bool array
+            Mask of the component, cropped to its bounding box.
+        x, y : int
+            Position of the crop's top left corner in the full image.
+
+        Returns
+        -------
+        3-tuple
+            The component's bounding box as (x, y, width, height), its outer
+            contour, and its rectangle as corners or None if it is not a box.
+        '''
+        # Pad so that the contour is traced the same as in the full image
+        padded = cv2.copyMakeBorder(component.astype(np.uint8), 1, 1, 1, 1,
+                                    cv2.BORDER_CONSTANT, value=0)
+        contour = cv2.findContours(padded,
+                                   cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_SIMPLE,
+                                   offset=(x - 1, y - 1))[1][0]
+
+        rectangle = None
+        if cv2.contourArea(contour) >= self._min_size:
+            epsilon = self._max_dist_fraction * \
+                cv2.arcLength(contour, closed=True)
+            polygon_approx = cv2.approxPolyDP(contour, epsilon, closed=True)
+            if len(polygon_approx) == 4:  # Count corners
+                rectangle = polygon_approx
+
+        height, width = component.shape
+        return (x, y, width, height), contour, rectangle
+
+    def _add_components(self, labels, stats, keep, x, y):
+        '''
+        Relabel and describe newly found components.
+
+        Parameters
+        ----------
+        labels : numpy int32 array
+            Labels from connectedComponentsWithStats over a crop of the mask.
+        stats : numpy int32 array
+            Stats from connectedComponentsWithStats over the same crop.
+        keep : iterable of int
+            Labels in the crop to add.
+        x, y : int
+            Position of the crop's top left corner in the full image.
+        '''
+        target = self._labels[y:y + len(labels), x:x + len(labels[0])]
+        for index in keep:
+            left, top, width, height = stats[index, :4]
+            component = labels[top:top + height, left:left + width] == index
+            label = self._next_label
+            self._next_label += 1
+            target[top:top + height, left:left + width][component] = label
+
+            # A contour's area is less than its bounding box's, so small
+            # components can neither be boxes nor enclose one
+            if width * height < self._min_size:
+                self._components[label] = \
+                    ((x + left, y + top, width, height), None, None)
+                continue
+
+            self._components[label] = \
+                self._describe_component(component, x + left, y + top)
+            self._outlined.add(label)
+
+    def _update_nesting(self, labels):
+        '''
+        Recheck whether boxes lie in a hole of another component.
+
+        Parameters
+        ----------
+        labels : iterable of int
+            Labels of the components to recheck; those without a rectangle
+            are ignored.
+        '''
+        for label in labels:
+            if self._components[label][2] is not None:
+                self._nested[label] = self._is_nested(label)
+
+    def _full_update(self, filtered):
+        '''
+        Recompute the mask and all components from scratch.
+
+        Parameters
+        ----------
+        filtered : opencv grayscale image
+            The frame, filtered to a color.
+        '''
+        self.reset()
+        self._filtered = filtered
+        self._mask = get_box_mask(filtered, self._blur_size,
+                                  self._dilate_size, self._tile_size,
+                                  self._num_threads)
+        self._labels = np.zeros(self._mask.shape, np.int32)
+
+        count, labels, stats, _ = \
+            cv2.connectedComponentsWithStats(self._mask, connectivity=8)
+        self._add_components(labels, stats, range(1, count), 0, 0)
+        self._update_nesting(self._outlined)
+
+    def _get_dirty_rects(self, filtered):
+        '''
+        Find the areas where the denoised mask may have changed.
+
+        Parameters
+        ----------
+        filtered : opencv grayscale image
+            The new frame, filtered to a color.
+
+        Returns
+        -------
+        list of 4-tuples or None
+            Rectangles as (x min, y min, x max, y max), or None if too much of
+            the frame changed for an incremental update to pay off.
+        '''
+        height, width = filtered.shape
+        c = self._cell_size
+        rows, cols = -(-height // c), -(-width // c)
+
+        changed = np.zeros((rows * c, cols * c), np.bool_)
+        changed[:height, :width] = filtered != self._filtered
+        dirty = changed.reshape(rows, c, cols, c).any(axis=(1, 3))
+
+        if dirty.mean() > self._max_dirty_fraction:
+            return None
+
+        count, _, stats, _ = \
+            cv2.connectedComponentsWithStats(dirty.astype(np.uint8),
+                                             connectivity=8)
+        rects = []
+        for left, top, cells_wide, cells_high in stats[1:count, :4]:
+            # A changed input pixel affects the mask up to one halo away
+            rects.append((max(left * c - self._halo, 0),
+                          max(top * c - self._halo, 0),
+                          min((left + cells_wide) * c + self._halo, width),
+                          min((top + cells_high) * c + self._halo, height)))
+        return rects
+
+    def _update_mask(self, filtered, rects):
+        '''
+        Recompute the denoised mask inside rectangles.
+
+        Parameters
+        ----------
+        filtered : opencv grayscale image
+            The new frame, filtered to a color.
+        rects : list of 4-tuples
+            Rectangles to recompute as (x min, y min, x max, y max).
+
+        Returns
+        -------
+        list of 4-tuples
+            Bounding rectangles of the mask pixels that changed.
+        '''
+        height, width = filtered.shape
+        halo = self._halo
+        changed_rects = []
+
+        for x_min, y_min, x_max, y_max in rects:
+            x_read, y_read = max(x_min - halo, 0), max(y_min - halo, 0)
+            x_end, y_end = min(x_max + halo, width), min(y_max + halo, height)
+            patch = get_box_mask(filtered[y_read:y_end, x_read:x_end],
+                                 self._blur_size, self._dilate_size)
+            patch = patch[y_min - y_read:y_max - y_read,
+                          x_min - x_read:x_max - x_read]
+
+            old = self._mask[y_min:y_max, x_min:x_max]
+            ys, xs = np.nonzero(patch != old)
+            if len(ys) == 0:
+                continue
+
+            old[...] = patch
+            changed_rects.append((x_min + xs.min(), y_min + ys.min(),
+                                  x_min + xs.max() + 1, y_min + ys.max() + 1))
+
+        return changed_rects
+
+    def _group_changes(self, changed_rects):
+        '''
+        Group changed rectangles with the components they touch.
+
+        Every component touching a changed pixel in a group, before or after
+        the change, lies entirely inside the group's bounding box.
+
+        Parameters
+        ----------
+        changed_rects : list of 4-tuples
+            Rectangles of changed mask pixels.
+
+        Returns
+        -------
+        list of 3-tuples
+            Each group as (bounding box, touch rectangles, old labels).
+        '''
+        height, width = self._mask.shape
+        groups = []
+        for x_min, y_min, x_max, y_max in changed_rects:
+            # Components 8-connected to a changed pixel touch the grown rect
+            touch = (max(x_min - 1, 0), max(y_min - 1, 0),
+                     min(x_max + 1, width), min(y_max + 1, height))
+            labels = np.unique(self._labels[touch[1]:touch[3],
+                                            touch[0]:touch[2]])
+            labels = set(labels[labels != 0].tolist())
+
+            box = list(touch)
+            for label in labels:
+                x, y, w, h = self._components[label][0]
+                box = [min(box[0], x), min(box[1], y),
+                       max(box[2], x + w), max(box[3], y + h)]
+            groups.append((box, [touch], labels))
+
+        # Merge overlapping groups until all are disjoint
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(groups)):
+                for j in range(i + 1, len(groups)):
+                    a, b = groups[i][0], groups[j][0]
+                    if a[0] < b[2] and b[0] < a[2] and \
+                            a[1] < b[3] and b[1] < a[3]:
+                        box = [min(a[0], b[0]), min(a[1], b[1]),
+                               max(a[2], b[2]), max(a[3], b[3])]
+                        groups[i] = (box, groups[i][1] + groups[j][1],
+                                     groups[i][2] | groups[j][2])
+                        del groups[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+
+        return groups
+
+    def _update_components(self, changed_rects):
+        '''
+        Recompute the components touching changed mask pixels.
+
+        Only boxes inside a changed group can have gained or lost an
+        enclosing component, since an enclosing component's bounding box
+        contains the box's. Their nesting is rechecked; all others keep their
+        cached nesting.
+
+        Parameters
+        ----------
+        changed_rects : list of 4-tuples
+            Rectangles of changed mask pixels.
+        '''
+        for box, touches, old_labels in self._group_changes(changed_rects):
+            x_min, y_min, x_max, y_max = box
+
+            crop_labels = self._labels[y_min:y_max, x_min:x_max]
+            if old_labels:
+                crop_labels[np.isin(crop_labels, list(old_labels))] = 0
+                for label in old_labels:
+                    del self._components[label]
+                    self._outlined.discard(label)
+                    self._nested.pop(label, None)
+
+            count, labels, stats, _ = cv2.connectedComponentsWithStats(
+                self._mask[y_min:y_max, x_min:x_max], connectivity=8)
+
+            keep = set()
+            for t_x_min, t_y_min, t_x_max, t_y_max in touches:
+                keep.update(np.unique(labels[t_y_min - y_min:t_y_max - y_min,
+                                             t_x_min - x_min:t_x_max - x_min])
+                            .tolist())
+            keep.discard(0)
+
+            self._add_components(labels, stats, sorted(keep), x_min, y_min)
+
+            crop_labels = np.unique(crop_labels)
+            self._update_nesting(crop_labels[crop_labels != 0].tolist())
+
+    def _is_nested(self, label):
+        '''
+        Check if a component lies in a hole of another component.
+
+        Such components have no external contour in the full image, so they
+        are not detected by get_rectangular_boxes.
+
+        Parameters
+        ----------
+        label : int
+            Label of the component.
+
+        Returns
+        -------
+        bool
+            True if the component is inside another component's contour.
+        '''
+        (x, y, w, h), contour, _ = self._components[label]
+        point = (float(contour[0][0][0]), float(contour[0][0][1]))
+
+        # Only components large enough to be traced can enclose a box
+        for other in self._outlined:
+            (o_x, o_y, o_w, o_h), o_contour, _ = self._components[other]
+            if o_x < x and o_y < y and x + w < o_x + o_w and \
+                    y + h < o_y + o_h and \
+                    cv2.pointPolygonTest(o_contour, point, False) > 0:
+                return True
+
+        return False
+
+    def update(self, filtered, as_array=False):
+        '''
+        Update the tracked boxes with a new frame.
+
+        Parameters
+        ----------
+        filtered : opencv grayscale image
+            The new frame, filtered to a color.
+        as_array (optional) : bool
+            If True, return the rectangles as arrays from get_box_arrays.
+
+        Returns
+        -------
+        list or 2-tuple of numpy arrays
+            A list of detected rectangles as their corners, in no particular
+            order, or if as_array is True, their corners and bounding boxes.
+        '''
+        if self._filtered is None or filtered.shape != self._filtered.shape:
+            self._full_update(filtered)
+            return self.get_boxes(as_array)
+
+        rects = self._get_dirty_rects(filtered)
+        if rects is None:
+            self._full_update(filtered)
+            return self.get_boxes(as_array)
+
+        self._filtered = filtered
+        changed_rects = self._update_mask(filtered, rects)
+        if changed_rects:
+            self._update_components(changed_rects)
+
+        return self.get_boxes(as_array)
+
+    def get_boxes(self, as_array=False):
+        '''
+        Get the boxes detected in the last frame.
+
+        Parameters
+        ----------
+        as_array (optional) : bool
+            If True, return the rectangles as arrays from get_box_arrays.
+
+        Returns
+        -------
+        list or 2-tuple of numpy arrays
+            A list of detected rectangles as their corners, in no particular
+            order, or if as_array is True, their corners and bounding boxes.
+        '''
+        rectangles = [self._components[label][2]
+                      for label, nested in self._nested.items() if not nested]
+        if as_array:
+            return get_box_arrays(rectangles)
+        return rectangles
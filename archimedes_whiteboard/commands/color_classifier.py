@@ -0,0 +1,74 @@
+'''
+Implements Color_Classifier class.
+'''
+
+from archimedes_whiteboard.commands.region_extraction import \
+    (build_color_lut, classify_colors, get_color_mask)
+
+
+class Color_Classifier():
+    '''
+    Filters a frame to the colors of all commands with one table lookup.
+
+    Replaces a cvtColor and inRange pass per command with a single lookup
+    per pixel into a table built once from all commands' color parameters.
+
+    Parameters
+    ----------
+    commands : list of Command
+        The configured commands; at most 32.
+    bits (optional) : int in [1, 8]
+        Bits per channel used to index the table. 8 is exact; fewer bits
+        give a smaller table that is approximate near color band edges.
+    tile_size (optional) : positive int or None
+        If not None, classify frames in tiles of this size on a thread pool.
+    num_threads (optional) : positive int or None
+        Number of threads to use for tiled classification.
+    '''
+
+    def __init__(self, commands, bits=8, tile_size=None, num_threads=None):
+        self._bits = bits
+        self._tile_size = tile_size
+        self._num_threads = num_threads
+        self._indices = {id(command): i for i, command in enumerate(commands)}
+        self._lut = build_color_lut([(command.target_hue,
+                                      command.tol_hue,
+                                      command.min_saturation,
+                                      command.min_value)
+                                     for command in commands], bits)
+
+    def classify(self, image):
+        '''
+        Classify every pixel of an image against all commands' colors.
+
+        Parameters
+        ----------
+        image : opencv bgr image
+            A normalized image of the whiteboard.
+
+        Returns
+        -------
+        numpy array
+            The color bitmask of each pixel, to pass to act_on_frame.
+        '''
+        return classify_colors(image, self._lut, self._bits,
+                               self._tile_size, self._num_threads)
+
+    def get_mask(self, classes, command):
+        '''
+        Get one command's color mask from a classified image.
+
+        Parameters
+        ----------
+        classes : numpy array
+            Color bitmasks from classify.
+        command : Command
+            One of the commands the classifier was built for.
+
+        Returns
+        -------
+        opencv grayscale image
+            An image only containing pixels of the command's color, as from
+            Command.filter_image.
+        '''
+        return get_color_mask(classes, self._indices[id(command)])
@@ -2,9 +2,14 @@
 Implements Command abstract base class.
 '''
 
+import cv2
+import numpy as np
 from archimedes_whiteboard.commands.region_extraction import \
     (filter_to_color, get_rectangular_boxes)
 from archimedes_whiteboard.commands.block_region import Block_Region
+from archimedes_whiteboard.commands.box_tracker import Box_Tracker
+from archimedes_whiteboard.commands.preprocess import Region_Preprocessor
+from archimedes_whiteboard.store import get_store, hash_image
 
 
 class Command():
@@ -20,6 +25,16 @@ class Command():
     yaml_tag : unicode string
         YAML tag of this command. Used internally to map from YAML sections
         to classes and should be distinct for each different type of command.
+    scheduler : Scheduler or None
+        If not None, regions are queued on this scheduler instead of being
+        evaluated inline. Set by the runner, not through YAML config.
+    color_classifier : Color_Classifier or None
+        The classifier built for all commands, used when act_on_frame is
+        given classified colors. Set by the runner, not through YAML config.
+    marker_length : number or None
+        Side length of the board's markers at the default resolution
+        (pixels), from get_marker_length, used by pre-processing to measure
+        the board resolution. Set by the runner, not through YAML config.
 
     Parameters
     ----------
@@ -47,6 +62,49 @@ class Command():
     block_clear_pixels (optional) : positive int
         Number of pixels surrounding target corners in each direction that
         must all be clear to unblock.
+    tile_size (optional) : positive int or None
+        If not None, filter and denoise the board in tiles of this size on a
+        thread pool. Detected boxes are identical to the untiled result.
+    num_threads (optional) : positive int or None
+        Number of threads to use for tiled processing. If None, uses the
+        number of CPUs.
+    incremental (optional) : bool
+        If True, track boxes across frames and only re-examine the areas of
+        the board that changed since the last frame.
+    store_directory (optional) : str path to a directory or None
+        If not None, record every region and this command's result in a
+        Region_Store in this directory, and skip regions whose image this
+        command has already processed, even before a restart. Regions are
+        recorded after pre-processing and matched by exact pixel content, so
+        only identical images are skipped; binarizing makes repeats of the
+        same content far more likely to match than raw camera pixels.
+    detection_scale (optional) : number in (0, 1]
+        Scale at which to detect boxes, relative to the normalized board.
+        Usually set by an Adaptive_Controller rather than in config.
+    normal_scale (optional) : positive number
+        Resolution of the normalized board this command is given, relative
+        to the default. Box detection sizes are scaled to match. Change it
+        with set_normal_scale so blocked regions follow; usually set by an
+        Adaptive_Controller rather than in config.
+    preprocess (optional) : dict or None
+        If not None, keyword arguments for a Region_Preprocessor that cleans
+        up and shrinks regions before they are evaluated, e.g. deskew,
+        remove_border, marker_size or board_dpi, target_dpi, and binarize.
+    priority (optional) : number
+        Scheduling priority; regions of higher priority commands run first.
+    deadline (optional) : positive number or None
+        If not None, seconds after detection after which a scheduled region
+        is dropped instead of evaluated.
+    max_queue (optional) : positive int
+        Maximum number of scheduled regions waiting for this command.
+    overflow (optional) : str
+        What to do with a new region when the queue is full: 'drop_oldest',
+        'coalesce' (replace a queued overlapping region), or 'reject'.
+    max_concurrent (optional) : positive int or None
+        Maximum number of scheduler workers this command may occupy at once.
+        Keep it below the number of workers for expensive commands so that
+        other commands always have a free worker. None for no limit, only
+        for commands whose _evaluate is safe to run concurrently.
     '''
 
     yaml_tag = u'!Command'
@@ -62,6 +120,34 @@ class Command():
     box_min_size = 1000
     blur_size = 21
     dilate_size = 5
+    incremental = False
+    detection_scale = 1
+    normal_scale = 1
+    _box_tracker = None
+    _box_tracker_scale = None
+
+    # Tiled execution parameters
+    tile_size = None
+    num_threads = None
+
+    # Region pre-processing parameters
+    preprocess = None
+    marker_length = None
+    _preprocessor = None
+
+    # Result storage parameters
+    store_directory = None
+
+    # Shared lookup table color filtering
+    color_classifier = None
+
+    # Scheduling parameters
+    scheduler = None
+    priority = 0
+    deadline = None
+    max_queue = 8
+    overflow = 'drop_oldest'
+    max_concurrent = 1
 
     # Blocking parameters
     blocked_regions = []
@@ -76,79 +162,377 @@ class Command():
         Parameters
         ----------
         command_region : opencv bgr image
-            An image of the region to act on.
+            An image of the region to act on. Grayscale if pre-processing
+            binarizes regions.
+
+        Returns
+        -------
+        str or None
+            Optionally, a result to record in the store, e.g. a saved path.
         '''
         pass
 
-    def _get_image_blocked(self, image):
+    def _get_preprocessor(self):
+        '''
+        Get this command's region pre-processor, creating it if needed.
+
+        Returns
+        -------
+        Region_Preprocessor
+            A pre-processor configured from this command's preprocess options.
+        '''
+        if self._preprocessor is None:
+            self._preprocessor = Region_Preprocessor(self.target_hue,
+                                                     self.tol_hue,
+                                                     self.min_saturation,
+                                                     self.min_value,
+                                                     **self.preprocess)
+        return self._preprocessor
+
+    def _process_region(self, command_region, bbox, corners, normal_scale=1):
+        '''
+        Pre-process and evaluate a region, recording it and its result if a
+        store is set.
+
+        Parameters
+        ----------
+        command_region : opencv bgr image
+            An image of the region to act on.
+        bbox : 4-tuple of ints
+            Bounding box of the region as (x min, y min, x max, y max).
+        corners : numpy array
+            Corners of the box as a 4 x 2 array, in board coordinates.
+        normal_scale (optional) : positive number
+            Resolution of the board the region was detected on, relative to
+            the default.
+        '''
+        if self.preprocess is not None:
+            command_region = self._get_preprocessor().process(
+                command_region, corners - np.array(bbox[:2]),
+                hash_image(command_region), normal_scale, self.marker_length)
+
+        store = None
+        if self.store_directory is not None:
+            store = get_store(self.store_directory)
+            image_hash = hash_image(command_region)
+            # Record positions at the default resolution
+            bbox = [int(round(value / normal_scale)) for value in bbox]
+            if not store.claim(image_hash, self.yaml_tag):
+                # Done or being done on another worker, possibly before a
+                # restart; the image is already stored
+                store.add_region(command_region, bbox, self.yaml_tag,
+                                 image_hash, store_image=False)
+                return
+
+        try:
+            if store is not None:
+                store.add_region(command_region, bbox, self.yaml_tag,
+                                 image_hash)
+            result = self._evaluate(command_region)
+        except BaseException:
+            if store is not None:
+                store.release(image_hash, self.yaml_tag)  # Allow a retry
+            raise
+
+        if store is not None:
+            store.add_result(image_hash, self.yaml_tag, result)
+
+    def _make_block_region(self, corners, bounds=None):
+        '''
+        Create a Block_Region with this command's blocking parameters.
+
+        Parameters
+        ----------
+        corners : 4-tuple of (x, y) 2-tuples
+            Corners of the region.
+        bounds (optional) : 4-tuple of ints or None
+            Bounding box of the corners, if already computed.
+
+        Returns
+        -------
+        Block_Region
+            A new blocked region.
+        '''
+        return Block_Region(corners,
+                            self.target_hue,
+                            self.block_clear_frames,
+                            self.block_clear_pixels,
+                            self.cooldown_frames,
+                            self.tol_hue,
+                            self.min_saturation,
+                            self.min_value,
+                            bounds)
+
+    def get_state(self):
+        '''
+        Get the state needed to resume this command after a restart.
+
+        Regions whose scheduled evaluation has not finished are left out, so
+        that they are detected and evaluated again after a restart.
+
+        Returns
+        -------
+        list of 3-tuples
+            The state of each blocked region, from Block_Region.get_state.
+        '''
+        return [region.get_state() for region in self.blocked_regions
+                if not region.is_pending()]
+
+    def set_state(self, state):
+        '''
+        Restore blocked regions saved by get_state.
+
+        Parameters
+        ----------
+        state : list of 3-tuples
+            The state of each blocked region, from Block_Region.get_state.
+        '''
+        self.blocked_regions = []
+        for corners, cooldown_remaining, clear_remaining in state:
+            block = self._make_block_region(corners)
+            block.set_counters(cooldown_remaining, clear_remaining)
+            self.blocked_regions.append(block)
+
+    def set_normal_scale(self, scale):
+        '''
+        Change the resolution of the normalized board this command is given.
+
+        Blocked regions are rescaled so that they stay over their boxes.
+
+        Parameters
+        ----------
+        scale : positive number
+            The new resolution, relative to the default.
+        '''
+        if scale == self.normal_scale:
+            return
+
+        for region in self.blocked_regions:
+            region.rescale(scale / self.normal_scale)
+        self.normal_scale = scale
+
+    def _get_detection_parameters(self):
+        '''
+        Get box detection size parameters scaled by normal_scale and
+        detection_scale.
+
+        Returns
+        -------
+        3-tuple of ints
+            The box minimum size, blur size, and dilate size to use.
+        '''
+        scale = self.normal_scale * self.detection_scale
+        if scale == 1:
+            return self.box_min_size, self.blur_size, self.dilate_size
+
+        min_size = int(self.box_min_size * scale * scale)
+        blur_size, dilate_size = 0, 0
+        if self.blur_size > 0:
+            blur_size = int(self.blur_size * scale) | 1  # Must stay odd
+        if self.dilate_size > 0:
+            dilate_size = max(int(round(self.dilate_size * scale)), 1)
+        return min_size, blur_size, dilate_size
+
+    def _get_box_tracker(self):
+        '''
+        Get this command's incremental box tracker, creating it if needed.
+
+        Returns
+        -------
+        Box_Tracker
+            A tracker configured with this command's box detection parameters.
+        '''
+        scale = self.normal_scale * self.detection_scale
+        if self._box_tracker is None or self._box_tracker_scale != scale:
+            min_size, blur_size, dilate_size = \
+                self._get_detection_parameters()
+            self._box_tracker = Box_Tracker(self.max_dist_fraction,
+                                            min_size,
+                                            blur_size,
+                                            dilate_size,
+                                            tile_size=self.tile_size,
+                                            num_threads=self.num_threads)
+            self._box_tracker_scale = scale
+        return self._box_tracker
+
+    def _get_image_blocked(self, image, filtered=None):
         '''
         Given an image, update all Block_Regions and return the image with all
         blocked areas masked in white.
 
+        If the image's color mask is given, it is used to check the regions'
+        corners, and the mask is returned with blocked areas zeroed instead.
+
         Parameters
         ----------
         image : opencv bgr image
             A normalized image of the full whiteboard.
+        filtered (optional) : opencv grayscale image or None
+            The image filtered to this command's color, if available.
 
         Returns
         -------
-        opencv bgr image
-            The input image, with all Block_Regions masked in white.
+        opencv bgr or grayscale image
+            The input image, with all Block_Regions masked in white, or the
+            color mask with all Block_Regions zeroed.
         '''
-        new_image = image.copy()
+        if filtered is None:
+            new_image, color = image.copy(), (255, 255, 255)
+            if self.blocked_regions:
+                # Filter once for all regions instead of once per region
+                filtered = self.filter_image(image)
+        else:
+            new_image, color = filtered.copy(), 0
 
         for region in self.blocked_regions:
-            region.update(image)
-            new_image = region.mask_region(new_image)
+            region.update(image, filtered)
+            new_image = region.mask_region(new_image, color)
+
+            # Drop queued work for regions erased before they were processed
+            if self.scheduler is not None and region.is_erased():
+                self.scheduler.cancel(region)
 
         # Remove clear regions
         self.blocked_regions = list(filter(lambda x: not x.is_clear(),
                                            self.blocked_regions))
         return new_image
 
-    def act_on_frame(self, image):
+    def filter_image(self, image):
+        '''
+        Filter an image to this command's color.
+
+        Parameters
+        ----------
+        image : opencv bgr image
+            A normalized image of the whiteboard.
+
+        Returns
+        -------
+        opencv grayscale image
+            An image only containing pixels of this command's color.
+        '''
+        return filter_to_color(image,
+                               self.target_hue,
+                               self.tol_hue,
+                               self.min_saturation,
+                               self.min_value,
+                               self.tile_size,
+                               self.num_threads)
+
+    def find_boxes(self, filtered):
+        '''
+        Find all boxes in an image filtered to this command's color.
+
+        Does not use or update Block_Regions.
+
+        Parameters
+        ----------
+        filtered : opencv grayscale image
+            A normalized image of the whiteboard, from filter_image.
+
+        Returns
+        -------
+        2-tuple of numpy int32 arrays
+            The corners of the detected boxes as an N x 4 x 2 array, and their
+            bounding boxes as an N x 4 array of (x min, y min, x max, y max),
+            in the coordinates of filtered.
+        '''
+        scale = self.detection_scale
+        if scale != 1:
+            filtered = cv2.resize(filtered, None, fx=scale, fy=scale,
+                                  interpolation=cv2.INTER_AREA)
+
+        if self.incremental:
+            quads, bounds = self._get_box_tracker().update(filtered,
+                                                           as_array=True)
+        else:
+            min_size, blur_size, dilate_size = \
+                self._get_detection_parameters()
+            quads, bounds = get_rectangular_boxes(filtered,
+                                                  self.max_dist_fraction,
+                                                  min_size,
+                                                  blur_size,
+                                                  dilate_size,
+                                                  self.tile_size,
+                                                  self.num_threads,
+                                                  as_array=True)
+
+        if scale != 1:
+            quads = np.round(quads / scale).astype(np.int32)
+            bounds = np.round(bounds / scale).astype(np.int32)
+        return quads, bounds
+
+    def detect_boxes(self, image):
+        '''
+        Find all boxes of this command's color in an image.
+
+        Does not use or update Block_Regions.
+
+        Parameters
+        ----------
+        image : opencv bgr image
+            A normalized image of the whiteboard.
+
+        Returns
+        -------
+        2-tuple of numpy int32 arrays
+            The corners and bounding boxes of the detected boxes, as returned
+            by find_boxes.
+        '''
+        return self.find_boxes(self.filter_image(image))
+
+    def act_on_frame(self, image, classes=None):
         '''
         Given an image, find all regions that correspond to this command
         and act on them.
 
-        Assumes that image is normalized.
+        Assumes that image is normalized at this command's normal_scale.
         Uses, updates, and creates Block_Regions.
 
         Parameters
         ----------
         image : opencv bgr image
             The input image.
+        classes (optional) : numpy array or None
+            Color bitmasks of the image from this command's color_classifier,
+            shared by all commands, to use instead of filtering the image.
+
+        Returns
+        -------
+        int
+            Number of new regions found.
+
+        Raises
+        ------
+        ValueError
+            If classes is given but color_classifier is not set.
         '''
-        blocked = self._get_image_blocked(image)
-        filtered = filter_to_color(blocked,
-                                   self.target_hue,
-                                   self.tol_hue,
-                                   self.min_saturation,
-                                   self.min_value)
+        if classes is not None and self.color_classifier is None:
+            raise ValueError('Classified colors given to ' + self.yaml_tag +
+                             ' but its color_classifier is not set')
+
+        # Filter once; blocked areas are zeroed in the mask, which matches
+        # filtering the image with them masked in white
+        if classes is None:
+            filtered = self.filter_image(image)
+        else:
+            filtered = self.color_classifier.get_mask(classes, self)
+        filtered = self._get_image_blocked(image, filtered)
 
-        boxes = get_rectangular_boxes(filtered,
-                                      self.max_dist_fraction,
-                                      self.box_min_size,
-                                      self.blur_size,
-                                      self.dilate_size)
+        quads, bounds = self.find_boxes(filtered)
 
         regions = []
-        for box in boxes:
-            xmin = min(box, key=lambda x: x[0][0])[0][0]
-            xmax = max(box, key=lambda x: x[0][0])[0][0]
-            ymin = min(box, key=lambda x: x[0][1])[0][1]
-            ymax = max(box, key=lambda x: x[0][1])[0][1]
-            regions.append(image[ymin:ymax, xmin:xmax])
-            corners = [tuple(corner[0]) for corner in box]
-            block = Block_Region(corners,
-                                 self.target_hue,
-                                 self.block_clear_frames,
-                                 self.block_clear_pixels,
-                                 self.cooldown_frames,
-                                 self.tol_hue,
-                                 self.min_saturation,
-                                 self.min_value)
+        for quad, bbox in zip(quads, bounds.tolist()):
+            xmin, ymin, xmax, ymax = bbox
+            block = self._make_block_region(quad, bbox)
+            regions.append((image[ymin:ymax, xmin:xmax], bbox, quad, block))
             self.blocked_regions.append(block)
 
-        for region in regions:
-            self._evaluate(region)
+        for region, bbox, quad, block in regions:
+            if self.scheduler is None:
+                self._process_region(region, bbox, quad, self.normal_scale)
+            else:
+                block.set_pending(True)
+                self.scheduler.submit(self, region.copy(), bbox, quad, block)
+
+        return len(regions)
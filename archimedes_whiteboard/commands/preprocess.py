@@ -0,0 +1,278 @@
+'''
+Implements Region_Preprocessor class.
+'''
+
+import logging
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from archimedes_whiteboard.commands.region_extraction import filter_to_color
+
+
+logger = logging.getLogger(__name__)
+
+
+def order_corners(corners):
+    '''
+    Order the corners of a quadrilateral clockwise from the top left.
+
+    Parameters
+    ----------
+    corners : numpy array
+        The four corners as a 4 x 2 array, in any order.
+
+    Returns
+    -------
+    numpy float32 array
+        The corners as a 4 x 2 array ordered top left, top right, bottom
+        right, bottom left.
+    '''
+    corners = np.asarray(corners, np.float32).reshape(4, 2)
+
+    # Sort by angle around the centroid, which is clockwise with y down, so
+    # each corner is used once even for a quadrilateral rotated near 45
+    # degrees; then start from the corner nearest the top left
+    offsets = corners - corners.mean(axis=0)
+    corners = corners[np.argsort(np.arctan2(offsets[:, 1], offsets[:, 0]))]
+    return np.roll(corners, -int(np.argmin(corners.sum(axis=1))), axis=0)
+
+
+class Region_Preprocessor():
+    '''
+    Shrinks and cleans up command regions before tasks consume them.
+
+    Outputs are cached by region hash, so a region seen again is not
+    processed twice.
+
+    Parameters
+    ----------
+    target_hue : number
+        The hue of the command's box border.
+    tol_hue (optional) : number
+        Range of acceptable hues around the border color.
+    min_saturation (optional) : number
+        Minimum saturation to detect the border color.
+    min_value (optional) : number
+        Minimum value to detect the border color.
+    deskew (optional) : bool
+        If True, warp the region so the box corners form an upright rectangle.
+    remove_border (optional) : bool
+        If True, white out pixels of the box border color.
+    border_dilate_size (optional) : int
+        Size of dilation applied to the border mask before removal.
+    board_dpi (optional) : number or None
+        Resolution of the normalized board at the default scale (pixels per
+        inch). Only used when it cannot be measured from the markers.
+    marker_size (optional) : number or None
+        Side length of the printed ArUco markers (inches). If set, the board
+        resolution is measured from the markers' size in the normalized
+        board instead of using board_dpi.
+    target_dpi (optional) : number or None
+        Resolution to downscale regions to. Regions are never upscaled.
+    binarize (optional) : bool
+        If True, output a black and white image of only the ink.
+    binarize_block_size (optional) : odd int
+        Size of the neighborhood used to pick each pixel's threshold.
+    binarize_offset (optional) : number
+        How much darker than its neighborhood a pixel must be to be ink.
+    cache_size (optional) : int
+        Number of processed regions to keep cached.
+    '''
+
+    def __init__(self, target_hue, tol_hue=35, min_saturation=10,
+                 min_value=50, deskew=False, remove_border=False,
+                 border_dilate_size=5, board_dpi=None, marker_size=None,
+                 target_dpi=None, binarize=False, binarize_block_size=31,
+                 binarize_offset=15, cache_size=64):
+        self._target_hue = target_hue
+        self._tol_hue = tol_hue
+        self._min_saturation = min_saturation
+        self._min_value = min_value
+
+        self._deskew = deskew
+        self._remove_border = remove_border
+        self._border_dilate_size = border_dilate_size
+        self._board_dpi = board_dpi
+        self._marker_size = marker_size
+        self._warned_unmeasured = False
+        self._target_dpi = target_dpi
+        self._binarize = binarize
+        self._binarize_block_size = binarize_block_size
+        self._binarize_offset = binarize_offset
+
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+    def _deskew_region(self, region, corners):
+        '''
+        Warp a region so that its box corners form an upright rectangle.
+
+        Parameters
+        ----------
+        region : opencv bgr image
+            The region, cropped to the box's bounding box.
+        corners : numpy array
+            The box corners as a 4 x 2 array, relative to the region.
+
+        Returns
+        -------
+        opencv bgr image
+            The region inside the box, upright.
+        '''
+        top_left, top_right, bottom_right, bottom_left = \
+            order_corners(corners)
+        width = int(max(np.linalg.norm(top_right - top_left),
+                        np.linalg.norm(bottom_right - bottom_left)))
+        height = int(max(np.linalg.norm(bottom_left - top_left),
+                         np.linalg.norm(bottom_right - top_right)))
+
+        source = np.array([top_left, top_right, bottom_right, bottom_left])
+        target = np.array([(0, 0), (width, 0), (width, height), (0, height)],
+                          np.float32)
+        transform = cv2.getPerspectiveTransform(source, target)
+        return cv2.warpPerspective(region, transform, (width, height),
+                                   borderMode=cv2.BORDER_CONSTANT,
+                                   borderValue=(255, 255, 255))
+
+    def _remove_border_color(self, region):
+        '''
+        White out the box border color in a region.
+
+        Parameters
+        ----------
+        region : opencv bgr image
+            The region.
+
+        Returns
+        -------
+        opencv bgr image
+            A copy of the region with the border color whited out.
+        '''
+        mask = filter_to_color(region, self._target_hue, self._tol_hue,
+                               self._min_saturation, self._min_value)
+        if self._border_dilate_size > 0:
+            kernel = np.ones((self._border_dilate_size,
+                              self._border_dilate_size), np.uint8)
+            mask = cv2.dilate(mask, kernel, iterations=1)
+
+        region = region.copy()
+        region[mask > 0] = (255, 255, 255)
+        return region
+
+    def get_board_dpi(self, scale=1, marker_length=None):
+        '''
+        Get the resolution of the normalized board.
+
+        Parameters
+        ----------
+        scale (optional) : positive number
+            Resolution of the normalized board relative to the default.
+        marker_length (optional) : number or None
+            Side length of the markers at the default resolution (pixels),
+            from get_marker_length, if known.
+
+        Returns
+        -------
+        number or None
+            Pixels per inch of the board, or None if unknown.
+        '''
+        board_dpi = self._board_dpi
+        if self._marker_size and marker_length:
+            board_dpi = marker_length / self._marker_size
+        if not board_dpi:
+            return None
+        return board_dpi * scale
+
+    def _process(self, region, corners, board_dpi):
+        '''
+        Run all configured pre-processing steps on a region.
+
+        Parameters
+        ----------
+        region : opencv bgr image
+            The region, cropped to the box's bounding box.
+        corners : numpy array
+            The box corners as a 4 x 2 array, relative to the region.
+        board_dpi : number or None
+            Resolution of the normalized board (pixels per inch), if known.
+
+        Returns
+        -------
+        opencv bgr or grayscale image
+            The processed region; grayscale if binarized.
+        '''
+        if self._deskew:
+            region = self._deskew_region(region, corners)
+
+        if self._remove_border:
+            region = self._remove_border_color(region)
+
+        if board_dpi and self._target_dpi and self._target_dpi < board_dpi:
+            factor = self._target_dpi / board_dpi
+            region = cv2.resize(region, None, fx=factor, fy=factor,
+                                interpolation=cv2.INTER_AREA)
+
+        if self._binarize:
+            gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+            block_size = min(self._binarize_block_size,
+                             (min(gray.shape) - 1) | 1)
+            if block_size >= 3:
+                region = cv2.adaptiveThreshold(gray, 255,
+                                               cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                               cv2.THRESH_BINARY,
+                                               block_size,
+                                               self._binarize_offset)
+            else:
+                region = gray
+
+        return region
+
+    def process(self, region, corners, image_hash, scale=1,
+                marker_length=None):
+        '''
+        Pre-process a region, reusing the cached output if there is one.
+
+        Parameters
+        ----------
+        region : opencv bgr image
+            The region, cropped to the box's bounding box.
+        corners : numpy array
+            The box corners as a 4 x 2 array, relative to the region.
+        image_hash : str
+            Hash of the region image, from hash_image.
+        scale (optional) : positive number
+            Resolution of the normalized board relative to the default.
+        marker_length (optional) : number or None
+            Side length of the markers at the default resolution (pixels),
+            from get_marker_length, if known.
+
+        Returns
+        -------
+        opencv bgr or grayscale image
+            The processed region; grayscale if binarized.
+        '''
+        if self._marker_size and not marker_length and \
+                not self._warned_unmeasured:
+            logger.warning('marker_size is set but the marker length is '
+                           'unknown, so the board resolution cannot be '
+                           'measured; falling back to board_dpi %s',
+                           self._board_dpi)
+            self._warned_unmeasured = True
+
+        board_dpi = self.get_board_dpi(scale, marker_length)
+        key = (image_hash, np.asarray(corners, np.int32).tobytes(), board_dpi)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        processed = self._process(region, corners, board_dpi)
+
+        with self._cache_lock:
+            self._cache[key] = processed
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        return processed
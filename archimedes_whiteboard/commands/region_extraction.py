@@ -3,12 +3,112 @@ Utilities for detecting and extracting command regions of different colors.
 '''
 
 
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 
 
+# Thread pools for tiled execution, keyed by number of threads
+_EXECUTORS = {}
+
+
+def _get_executor(num_threads=None):
+    '''
+    Get a shared thread pool for tiled execution.
+
+    Parameters
+    ----------
+    num_threads (optional) : positive int or None
+        Number of worker threads. If None, uses the number of CPUs.
+
+    Returns
+    -------
+    concurrent.futures.ThreadPoolExecutor
+        A thread pool with the requested number of workers.
+    '''
+    if num_threads is None:
+        num_threads = os.cpu_count() or 1
+
+    if num_threads not in _EXECUTORS:
+        _EXECUTORS[num_threads] = ThreadPoolExecutor(max_workers=num_threads)
+    return _EXECUTORS[num_threads]
+
+
+def _tile_bounds(length, tile_size, halo):
+    '''
+    Split one image axis into tiles with overlapping halos.
+
+    Parameters
+    ----------
+    length : int
+        Length of the axis (pixels).
+    tile_size : positive int
+        Length of each tile's interior (pixels).
+    halo : int
+        Number of extra pixels to read on each side of a tile's interior.
+
+    Yields
+    ------
+    4-tuple of ints
+        (read start, interior start, interior stop, read stop) of each tile.
+    '''
+    for start in range(0, length, tile_size):
+        stop = min(start + tile_size, length)
+        yield max(start - halo, 0), start, stop, min(stop + halo, length)
+
+
+def map_tiles(function, image, tile_size, halo=0, num_threads=None,
+              dtype=np.uint8):
+    '''
+    Apply a local image operation tile by tile on a thread pool.
+
+    Each tile is read with halo extra pixels on every side, so as long as
+    halo is at least the radius of the operation the stitched output exactly
+    matches applying the operation to the whole image. Tiles on the image
+    edge are not padded, so border handling also matches.
+
+    Parameters
+    ----------
+    function : callable
+        Operation mapping an image to a single-channel image of the same
+        width and height.
+    image : opencv image
+        The input image.
+    tile_size : positive int
+        Side length of each tile's interior (pixels).
+    halo (optional) : int
+        Number of overlapping pixels read around each tile.
+    num_threads (optional) : positive int or None
+        Number of worker threads. If None, uses the number of CPUs.
+    dtype (optional) : numpy dtype
+        Type of the operation's output.
+
+    Returns
+    -------
+    opencv single-channel image
+        The stitched output of the operation.
+    '''
+    height, width = image.shape[:2]
+    output = np.empty((height, width), dtype)
+
+    def run_tile(bounds):
+        (y_read, y_start, y_stop, y_end), (x_read, x_start, x_stop, x_end) = \
+            bounds
+        result = function(image[y_read:y_end, x_read:x_end])
+        output[y_start:y_stop, x_start:x_stop] = \
+            result[y_start - y_read:y_stop - y_read,
+                   x_start - x_read:x_stop - x_read]
+
+    tiles = itertools.product(_tile_bounds(height, tile_size, halo),
+                              _tile_bounds(width, tile_size, halo))
+    list(_get_executor(num_threads).map(run_tile, tiles))
+    return output
+
+
 def filter_to_color(image, target_hue, tol_hue=35, min_saturation=10,
-                    min_value=50):
+                    min_value=50, tile_size=None, num_threads=None):
     '''
     Filter an image to get only a specific color.
 
@@ -27,23 +127,293 @@ def filter_to_color(image, target_hue, tol_hue=35, min_saturation=10,
         Minimum saturation to detect the color.
     min_value (optional) : number
         Minimum value to detect the color.
+    tile_size (optional) : positive int or None
+        If not None, filter the image in tiles of this size on a thread pool.
+    num_threads (optional) : positive int or None
+        Number of threads to use for tiled filtering. If None, uses the
+        number of CPUs.
 
     Returns
     -------
     opencv grayscale image
         An image only containing pixels that are the specified color.
     '''
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
     low_color = np.array([target_hue - tol_hue, min_saturation, min_value])
     high_color = np.array([target_hue + tol_hue, 255, 255])
-    return cv2.inRange(image, low_color, high_color)
+
+    def filter_tile(tile):
+        tile = cv2.cvtColor(tile, cv2.COLOR_BGR2HSV)
+        return cv2.inRange(tile, low_color, high_color)
+
+    if tile_size is None:
+        return filter_tile(image)
+
+    # Filtering is per-pixel, so tiles need no overlap
+    return map_tiles(filter_tile, image, tile_size, 0, num_threads)
+
+
+def build_color_lut(bands, bits=8):
+    '''
+    Build a lookup table from BGR colors to a bitmask of matching colors.
+
+    Bit i of an entry is set if the color passes filter_to_color with the
+    parameters of band i. With bits=8 the table covers every BGR color and
+    is exact; fewer bits quantize each channel, giving a smaller, more
+    cache-friendly table that is approximate near band edges.
+
+    Parameters
+    ----------
+    bands : list of 4-tuples
+        Filter parameters (target_hue, tol_hue, min_saturation, min_value)
+        for up to 32 colors.
+    bits (optional) : int in [1, 8]
+        Bits per channel used to index the table.
+
+    Returns
+    -------
+    numpy array
+        A flat table of 2 ** (3 * bits) bitmasks, indexed by
+        b + (g << bits) + (r << 2 * bits) of the quantized channels.
+
+    Raises
+    ------
+    ValueError
+        If there are more than 32 bands.
+    '''
+    if len(bands) <= 8:
+        dtype = np.uint8
+    elif len(bands) <= 16:
+        dtype = np.uint16
+    elif len(bands) <= 32:
+        dtype = np.uint32
+    else:
+        raise ValueError('At most 32 colors fit in a lookup table')
+
+    # Represent each quantized level by the center of its range
+    levels = 1 << bits
+    shift = 8 - bits
+    values = (np.arange(levels) << shift) + ((1 << shift) >> 1)
+
+    # Fill the table one red level at a time to bound memory use
+    colors = np.empty((levels, levels, 3), np.uint8)
+    colors[..., 0] = values[np.newaxis, :]  # Blue varies fastest
+    colors[..., 1] = values[:, np.newaxis]
+
+    lut = np.zeros(levels ** 3, dtype)
+    for red in range(levels):
+        colors[..., 2] = values[red]
+        entries = lut[red * levels * levels:(red + 1) * levels * levels]
+        for i, (target_hue, tol_hue, min_saturation, min_value) in \
+                enumerate(bands):
+            mask = filter_to_color(colors, target_hue, tol_hue,
+                                   min_saturation, min_value)
+            entries[mask.ravel() > 0] |= dtype(1 << i)
+
+    return lut
+
+
+def classify_colors(image, lut, bits=8, tile_size=None, num_threads=None):
+    '''
+    Look up the color bitmask of every pixel in an image.
+
+    Skips the HSV conversion entirely; every configured color is tested by a
+    single table lookup per pixel.
+
+    Parameters
+    ----------
+    image : opencv bgr image
+        The input image.
+    lut : numpy array
+        Lookup table from build_color_lut.
+    bits (optional) : int in [1, 8]
+        Bits per channel the table was built with.
+    tile_size (optional) : positive int or None
+        If not None, classify the image in tiles of this size on a thread
+        pool.
+    num_threads (optional) : positive int or None
+        Number of threads to use for tiled classification. If None, uses the
+        number of CPUs.
+
+    Returns
+    -------
+    numpy array
+        The bitmask of each pixel, of the table's type.
+    '''
+    def classify_tile(tile):
+        if bits == 8:
+            # Pack each pixel into one little-endian int as b, g, r, alpha
+            packed = cv2.cvtColor(tile, cv2.COLOR_BGR2BGRA)
+            index = packed.view(np.uint32)[..., 0] & 0xFFFFFF
+        else:
+            shift = 8 - bits
+            quantized = (tile >> shift).astype(np.uint32)
+            index = quantized[..., 0] | (quantized[..., 1] << bits) | \
+                (quantized[..., 2] << (2 * bits))
+        return lut[index]
+
+    if tile_size is None:
+        return classify_tile(image)
+
+    return map_tiles(classify_tile, image, tile_size, 0, num_threads,
+                     lut.dtype)
+
+
+def get_color_mask(classes, index):
+    '''
+    Get the mask of one color from a classified image.
+
+    Parameters
+    ----------
+    classes : numpy array
+        Color bitmasks from classify_colors.
+    index : int
+        Index of the color's band in the lookup table.
+
+    Returns
+    -------
+    opencv grayscale image
+        An image only containing pixels of the color, as from
+        filter_to_color.
+    '''
+    bit = classes.dtype.type(1 << index)
+    return np.where(classes & bit, np.uint8(255), np.uint8(0))
+
+
+def get_box_mask_halo(blur_size=21, dilate_size=5):
+    '''
+    Get the radius of the denoising done by get_box_mask.
+
+    Parameters
+    ----------
+    blur_size (optional) : odd int
+        Size of gaussian blur to apply.
+    dilate_size (optional) : int
+        Size of dilation to apply.
+
+    Returns
+    -------
+    int
+        Maximum distance (pixels) from which an input pixel can affect an
+        output pixel of get_box_mask.
+    '''
+    halo = 0
+    if blur_size > 0:
+        halo += blur_size // 2
+    if dilate_size > 0:
+        halo += 3 * (dilate_size // 2)  # Erode, dilate, then dilate again
+    return halo
+
+
+def get_box_mask(image, blur_size=21, dilate_size=5, tile_size=None,
+                 num_threads=None):
+    '''
+    Denoise a color-filtered image into a binary mask of box components.
+
+    Parameters
+    ----------
+    image : opencv grayscale image
+        The image, filtered to a color.
+    blur_size (optional) : odd int
+        Size of gaussian blur to apply; used for denoising.
+    dilate_size (optional) : int
+        Size of dilation to apply; used for closing holes.
+    tile_size (optional) : positive int or None
+        If not None, process the image in overlapping tiles of this size on a
+        thread pool. The result is identical to the untiled result.
+    num_threads (optional) : positive int or None
+        Number of threads to use for tiled processing. If None, uses the
+        number of CPUs.
+
+    Returns
+    -------
+    opencv grayscale image
+        A binary mask of the regions that may be boxes.
+    '''
+    kernel = np.ones((dilate_size, dilate_size), np.uint8)
+
+    def mask_tile(tile):
+        if blur_size > 0:
+            tile = cv2.GaussianBlur(tile, (blur_size, blur_size), 0)
+        tile = cv2.threshold(tile, 60, 255, cv2.THRESH_BINARY)[1]
+        if dilate_size > 0:
+            # Open to remove noise, then dilate to connect box components
+            tile = cv2.morphologyEx(tile, cv2.MORPH_OPEN, kernel)
+            tile = cv2.dilate(tile, kernel, iterations=1)
+        return tile
+
+    if tile_size is None:
+        return mask_tile(image)
+
+    halo = get_box_mask_halo(blur_size, dilate_size)
+    return map_tiles(mask_tile, image, tile_size, halo, num_threads)
+
+
+def get_box_arrays(rectangles):
+    '''
+    Stack rectangles into arrays of corners and bounding boxes.
+
+    Parameters
+    ----------
+    rectangles : list
+        Rectangles as returned by get_rectangular_boxes, each with four
+        corners.
+
+    Returns
+    -------
+    2-tuple of numpy int32 arrays
+        The corners as an N x 4 x 2 array, and the bounding boxes as an
+        N x 4 array of (x min, y min, x max, y max).
+    '''
+    if len(rectangles) == 0:
+        return np.empty((0, 4, 2), np.int32), np.empty((0, 4), np.int32)
+
+    quads = np.stack(rectangles).reshape(-1, 4, 2).astype(np.int32)
+    bounds = np.concatenate([quads.min(axis=1), quads.max(axis=1)], axis=1)
+    return quads, bounds
+
+
+def get_contour_areas(contours):
+    '''
+    Get the areas of many contours at once.
+
+    Gives the same areas as cv2.contourArea, but applies the shoelace
+    formula to all contours' points in one pass instead of one call per
+    contour.
+
+    Parameters
+    ----------
+    contours : list of numpy int32 arrays
+        Contours as returned by findContours.
+
+    Returns
+    -------
+    numpy float64 array
+        The area of each contour.
+    '''
+    if len(contours) == 0:
+        return np.empty(0)
+
+    lengths = np.fromiter(map(len, contours), np.intp, len(contours))
+    starts = np.cumsum(lengths) - lengths
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+
+    # Index of the next point, wrapping around within each contour
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+
+    x, y = points[:, 0], points[:, 1]
+    cross = x * y[following] - x[following] * y
+    return np.abs(np.add.reduceat(cross, starts)) / 2
 
 
 def get_rectangular_boxes(image,
                           max_dist_fraction=0.05,
                           min_size=1000,
                           blur_size=21,
-                          dilate_size=5):
+                          dilate_size=5,
+                          tile_size=None,
+                          num_threads=None,
+                          as_array=False):
     '''
     Find all rectangular boxes in an image.
 
@@ -64,39 +434,44 @@ def get_rectangular_boxes(image,
         Size of gaussian blur to apply; used for denoising.
     dilate_size (optional) : int
         Size of dilation to apply; used for closing holes.
+    tile_size (optional) : positive int or None
+        If not None, denoise the image in overlapping tiles of this size on a
+        thread pool. Tiles are stitched before contours are found, so the
+        detected rectangles are identical to the untiled result.
+    num_threads (optional) : positive int or None
+        Number of threads to use for tiled processing. If None, uses the
+        number of CPUs.
+    as_array (optional) : bool
+        If True, return the rectangles as arrays from get_box_arrays.
 
     Returns
     -------
-    list
-        A list of detected rectangles as their corners.
+    list or 2-tuple of numpy arrays
+        A list of detected rectangles as their corners, or if as_array is
+        True, their corners and bounding boxes as arrays.
     '''
     # For technique, see:
     # https://www.pyimagesearch.com/2016/02/08/opencv-shape-detection/ and
     # https://docs.opencv.org/3.1.0/dd/d49/tutorial_py_contour_features.html
-    if blur_size > 0:
-        image = cv2.GaussianBlur(image, (blur_size, blur_size), 0)
-    image = cv2.threshold(image, 60, 255, cv2.THRESH_BINARY)[1]
-    if dilate_size > 0:
-        kernel = np.ones((dilate_size, dilate_size))
-
-        # Open to remove noise, then dilate to connect box components
-        image = cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel)
-        image = cv2.dilate(image, kernel, iterations=1)
+    image = get_box_mask(image, blur_size, dilate_size, tile_size,
+                         num_threads)
 
     contours = cv2.findContours(image.copy(),
                                 cv2.RETR_EXTERNAL,
                                 cv2.CHAIN_APPROX_SIMPLE)[1]
 
-    rectangles = []
-    for contour in contours:
-        # Filter by area
-        if cv2.contourArea(contour) < min_size:
-            continue
-
-        epsilon = max_dist_fraction * cv2.arcLength(contour, closed=True)
-        polygon_approx = cv2.approxPolyDP(contour, epsilon, closed=True)
+    # Filter by area before the more expensive polygon approximation
+    areas = get_contour_areas(contours)
+    large = [contours[i] for i in np.flatnonzero(areas >= min_size)]
 
-        if len(polygon_approx) == 4:  # Count corners
-            rectangles.append(polygon_approx)
+    polygons = [cv2.approxPolyDP(contour,
+                                 max_dist_fraction *
+                                 cv2.arcLength(contour, closed=True),
+                                 closed=True)
+                for contour in large]
+    rectangles = [polygon for polygon in polygons
+                  if len(polygon) == 4]  # Count corners
 
+    if as_array:
+        return get_box_arrays(rectangles)
     return rectangles
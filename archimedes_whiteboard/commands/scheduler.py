@@ -0,0 +1,297 @@
+'''
+Implements Scheduler class.
+'''
+
+import logging
+import threading
+import time
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop_oldest', 'coalesce', 'reject')
+
+
+class _Job():
+    '''
+    A region waiting to be evaluated by a command.
+
+    Parameters
+    ----------
+    command : Command
+        The command to evaluate the region.
+    region : opencv bgr image
+        An image of the region.
+    bbox : 4-tuple of ints
+        Bounding box of the region as (x min, y min, x max, y max).
+    corners : numpy array
+        Corners of the box as a 4 x 2 array, in board coordinates.
+    block : Block_Region or None
+        The region's Block_Region, used to cancel the job if it is erased.
+    '''
+
+    def __init__(self, command, region, bbox, corners, block):
+        self.command = command
+        self.region = region
+        self.bbox = bbox
+        self.corners = corners
+        self.block = block
+        # The board scale may change before the job runs
+        self.normal_scale = command.normal_scale
+
+        self.submitted = time.monotonic()
+        self.expires = None
+        if command.deadline is not None:
+            self.expires = self.submitted + command.deadline
+
+    def overlaps(self, bbox):
+        '''
+        Check if this job's region overlaps a bounding box.
+
+        Parameters
+        ----------
+        bbox : 4-tuple of ints
+            Bounding box as (x min, y min, x max, y max).
+
+        Returns
+        -------
+        bool
+            True if the boxes overlap.
+        '''
+        return self.bbox[0] < bbox[2] and bbox[0] < self.bbox[2] and \
+            self.bbox[1] < bbox[3] and bbox[1] < self.bbox[3]
+
+    def is_stale(self, now):
+        '''
+        Check if this job should no longer run.
+
+        Parameters
+        ----------
+        now : number
+            The current time from time.monotonic.
+
+        Returns
+        -------
+        bool
+            True if the deadline has passed or the region was erased.
+        '''
+        if self.expires is not None and now > self.expires:
+            return True
+        return self.block is not None and self.block.is_erased()
+
+
+class Scheduler():
+    '''
+    Evaluates command regions on worker threads by priority and deadline.
+
+    Each command has a bounded queue. Workers always take the waiting job
+    with the highest command priority, then the earliest deadline, so cheap
+    latency-sensitive commands skip ahead of queued expensive ones. Running
+    jobs are not interrupted, so such commands only never wait for a worker
+    if the expensive commands' max_concurrent leaves one free. With the
+    default max_concurrent of 1, each command evaluates one region at a
+    time. Jobs whose deadline has passed or whose region was erased are
+    dropped without running.
+
+    Commands configure scheduling through their priority, deadline,
+    max_queue, overflow, and max_concurrent attributes. A job's
+    Block_Region is marked no longer pending once the job completes.
+
+    Parameters
+    ----------
+    num_workers (optional) : positive int
+        Number of worker threads.
+    '''
+
+    def __init__(self, num_workers=2):
+        self._queues = {}  # Command id -> deque of jobs
+        self._running = {}  # Command id -> number of running jobs
+        self._condition = threading.Condition()
+        self._stopping = False
+        self.stats = {'completed': 0, 'failed': 0, 'dropped': 0,
+                      'rejected': 0, 'coalesced': 0, 'stale': 0}
+
+        self._workers = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, command, region, bbox, corners, block=None):
+        '''
+        Queue a region to be evaluated by a command.
+
+        If the command's queue is full, applies its overflow policy:
+        'drop_oldest' drops the oldest queued job, 'coalesce' replaces a
+        queued job for an overlapping region (or else drops the oldest), and
+        'reject' drops the new job.
+
+        Parameters
+        ----------
+        command : Command
+            The command to evaluate the region.
+        region : opencv bgr image
+            An image of the region. Should not be modified after submitting.
+        bbox : 4-tuple of ints
+            Bounding box of the region as (x min, y min, x max, y max).
+        corners : numpy array
+            Corners of the box as a 4 x 2 array, in board coordinates.
+        block (optional) : Block_Region or None
+            The region's Block_Region, used to cancel the job if erased.
+
+        Returns
+        -------
+        bool
+            True if the job was queued, False if it was rejected.
+
+        Raises
+        ------
+        ValueError
+            If the command's overflow policy is not recognized.
+        '''
+        if command.overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy ' +
+                             str(command.overflow))
+
+        job = _Job(command, region, bbox, corners, block)
+        with self._condition:
+            queue = self._queues.setdefault(id(command), deque())
+
+            if len(queue) >= command.max_queue:
+                if command.overflow == 'reject':
+                    self.stats['rejected'] += 1
+                    return False
+
+                for i, queued in enumerate(queue):
+                    if command.overflow == 'coalesce' and \
+                            queued.overlaps(bbox):
+                        del queue[i]
+                        self.stats['coalesced'] += 1
+                        break
+                else:
+                    queue.popleft()
+                    self.stats['dropped'] += 1
+
+            queue.append(job)
+            self._condition.notify()
+        return True
+
+    def cancel(self, block):
+        '''
+        Drop all queued jobs for a region.
+
+        Parameters
+        ----------
+        block : Block_Region
+            The region's Block_Region.
+
+        Returns
+        -------
+        int
+            Number of jobs dropped.
+        '''
+        cancelled = 0
+        with self._condition:
+            for command_id, queue in self._queues.items():
+                kept = deque(job for job in queue if job.block is not block)
+                cancelled += len(queue) - len(kept)
+                self._queues[command_id] = kept
+            self.stats['stale'] += cancelled
+        return cancelled
+
+    def queue_depth(self):
+        '''
+        Get the number of jobs waiting to run.
+
+        Returns
+        -------
+        int
+            Number of queued jobs across all commands.
+        '''
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _next_job(self):
+        '''
+        Pop the most urgent runnable job, dropping stale jobs.
+
+        Must be called with the condition held.
+
+        Returns
+        -------
+        _Job or None
+            The job to run, or None if no job can run now.
+        '''
+        now = time.monotonic()
+        best = None
+        for command_id, queue in self._queues.items():
+            while queue and queue[0].is_stale(now):
+                queue.popleft()
+                self.stats['stale'] += 1
+            if not queue:
+                continue
+
+            job = queue[0]
+            limit = job.command.max_concurrent
+            if limit is not None and self._running.get(command_id, 0) >= limit:
+                continue
+
+            key = (-job.command.priority,
+                   job.expires if job.expires is not None else float('inf'),
+                   job.submitted)
+            if best is None or key < best[0]:
+                best = (key, command_id)
+
+        if best is None:
+            return None
+
+        command_id = best[1]
+        self._running[command_id] = self._running.get(command_id, 0) + 1
+        return self._queues[command_id].popleft()
+
+    def _work(self):
+        '''
+        Run jobs until the scheduler shuts down.
+        '''
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None and not self._stopping:
+                    self._condition.wait()
+                    job = self._next_job()
+                if job is None:
+                    return
+
+            try:
+                job.command._process_region(job.region, job.bbox,
+                                            job.corners, job.normal_scale)
+                if job.block is not None:
+                    job.block.set_pending(False)
+                outcome = 'completed'
+            except Exception:
+                logger.exception('Command %s failed on region %s',
+                                 job.command.yaml_tag, job.bbox)
+                outcome = 'failed'
+
+            with self._condition:
+                self._running[id(job.command)] -= 1
+                self.stats[outcome] += 1
+                # A concurrency slot opened up; wake other workers
+                self._condition.notify_all()
+
+    def shutdown(self, wait=True):
+        '''
+        Stop the workers once all queued jobs have run.
+
+        Parameters
+        ----------
+        wait (optional) : bool
+            If True, block until the workers have stopped.
+        '''
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+        if wait:
+            for worker in self._workers:
+                worker.join()
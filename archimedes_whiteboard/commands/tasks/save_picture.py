@@ -2,6 +2,7 @@
 Implements a command that saves an image locally.
 '''
 
+import itertools
 import time
 import yaml
 import cv2
@@ -21,7 +22,7 @@ class SavePicture(command.Command, yaml.YAMLObject):
     '''
 
     yaml_tag = u'!SavePicture'
-    _img_id = 0  # Prevent same-time name collision
+    _img_ids = itertools.count()  # Prevent same-time name collision
 
     def _evaluate(self, command_region):
         '''
@@ -31,8 +32,15 @@ class SavePicture(command.Command, yaml.YAMLObject):
         ----------
         command_region : opencv bgr image
             An image of the region to act on.
+
+        Returns
+        -------
+        str
+            The path the image was saved to.
         '''
         name = time.strftime('%Y-%m-%d,%H:%M:%S', time.gmtime())
-        path = self.directory + '/' + name + '_' + str(self._img_id) + '.png'
-        self._img_id += 1
+        # Taking the next id is atomic, so concurrent workers never share one
+        img_id = next(self._img_ids)
+        path = self.directory + '/' + name + '_' + str(img_id) + '.png'
         cv2.imwrite(path, command_region)
+        return path
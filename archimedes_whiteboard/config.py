@@ -0,0 +1,32 @@
+'''
+Loads the task configuration file.
+'''
+
+import yaml
+from archimedes_whiteboard.commands.command import Command
+from archimedes_whiteboard.commands.tasks import save_picture  # NOQA
+from archimedes_whiteboard.controller import Adaptive_Controller
+
+
+def load_config(path):
+    '''
+    Load commands and the optional controller policy from a YAML file.
+
+    Parameters
+    ----------
+    path : str path to a file
+        The configuration file, e.g. tasks.yml.
+
+    Returns
+    -------
+    2-tuple
+        The list of configured commands, in file order, and the configured
+        Adaptive_Controller or None if there is none.
+    '''
+    with open(path) as config:
+        documents = list(yaml.load_all(config, Loader=yaml.Loader))
+
+    commands = [doc for doc in documents if isinstance(doc, Command)]
+    controllers = [doc for doc in documents
+                   if isinstance(doc, Adaptive_Controller)]
+    return commands, (controllers[0] if controllers else None)
@@ -0,0 +1,290 @@
+'''
+Implements Adaptive_Controller class.
+'''
+
+import time
+from contextlib import contextmanager
+import yaml
+
+
+class Adaptive_Controller(yaml.YAMLObject):
+    '''
+    Adjusts capture rate and resolutions to the load on the pipeline.
+
+    Watches smoothed per-stage latencies and the task queue depth. When a
+    frame takes longer than the capture interval allows, or tasks back up,
+    it lowers the box detection scale, then the normalized board
+    resolution, then the frame rate. When there is headroom it restores them
+    in the opposite order. On an idle board with no boxes, it drops to an
+    idle frame rate.
+
+    Cannot be instantiated directly; objects are created through YAML config.
+
+    Parameters
+    ----------
+    min_fps (optional) : positive number
+        Lowest capture rate (frames per second).
+    max_fps (optional) : positive number
+        Highest capture rate (frames per second).
+    idle_fps (optional) : positive number
+        Capture rate once the board has had no boxes for idle_frames frames.
+    idle_frames (optional) : positive int
+        Number of frames without boxes before the board is idle.
+    min_normal_scale (optional) : positive number
+        Lowest normalized board resolution, relative to the default.
+    max_normal_scale (optional) : positive number
+        Highest normalized board resolution, relative to the default.
+    min_detection_scale (optional) : number in (0, 1]
+        Lowest box detection scale, relative to the normalized board.
+    max_detection_scale (optional) : number in (0, 1]
+        Highest box detection scale, relative to the normalized board.
+    high_load (optional) : positive number
+        Fraction of the capture interval above which a frame is too slow.
+    low_load (optional) : positive number
+        Fraction of the capture interval below which there is headroom.
+    max_queue_depth (optional) : int
+        Number of queued tasks above which the pipeline is overloaded.
+    step (optional) : number in (0, 1)
+        Factor by which a setting is lowered, or the inverse by which it is
+        raised, in each adjustment.
+    adjust_frames (optional) : positive int
+        Minimum number of frames between adjustments.
+    smoothing (optional) : number in (0, 1]
+        Weight of each new latency sample in the moving averages.
+    '''
+
+    yaml_tag = u'!Controller'
+
+    # Capture rate bounds
+    min_fps = 0.5
+    max_fps = 5
+    idle_fps = 1
+    idle_frames = 30
+
+    # Resolution bounds
+    min_normal_scale = 0.5
+    max_normal_scale = 1
+    min_detection_scale = 0.25
+    max_detection_scale = 1
+
+    # Load policy
+    high_load = 0.9
+    low_load = 0.5
+    max_queue_depth = 4
+    step = 0.8
+    adjust_frames = 5
+    smoothing = 0.3
+
+    _state = None
+
+    def _get_state(self):
+        '''
+        Get the controller's mutable state, initializing it if needed.
+
+        Returns
+        -------
+        dict
+            The current settings, latency averages, and frame counters.
+        '''
+        if self._state is None:
+            self._state = {
+                'fps': self.max_fps,
+                'normal_scale': self.max_normal_scale,
+                'detection_scale': self.max_detection_scale,
+                'latencies': {},
+                'queue_depth': 0,
+                'frames_without_boxes': 0,
+                'frames_since_adjust': 0,
+            }
+        return self._state
+
+    @property
+    def fps(self):
+        '''
+        Current capture rate (frames per second).
+        '''
+        state = self._get_state()
+        if state['frames_without_boxes'] >= self.idle_frames:
+            return min(state['fps'], self.idle_fps)
+        return state['fps']
+
+    @property
+    def normal_scale(self):
+        '''
+        Current normalized board resolution, relative to the default.
+        '''
+        return self._get_state()['normal_scale']
+
+    @property
+    def detection_scale(self):
+        '''
+        Current box detection scale, relative to the normalized board.
+        '''
+        return self._get_state()['detection_scale']
+
+    def get_frame_interval(self):
+        '''
+        Get the time to wait between captured frames.
+
+        Returns
+        -------
+        number
+            Seconds between frames at the current capture rate.
+        '''
+        return 1 / self.fps
+
+    def record_latency(self, stage, seconds):
+        '''
+        Record how long a pipeline stage took on the last frame.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage, e.g. 'normalize' or a command's YAML tag.
+        seconds : number
+            Time taken by the stage.
+        '''
+        latencies = self._get_state()['latencies']
+        if stage in latencies:
+            seconds = self.smoothing * seconds + \
+                (1 - self.smoothing) * latencies[stage]
+        latencies[stage] = seconds
+
+    @contextmanager
+    def time_stage(self, stage):
+        '''
+        Context manager that records the latency of the code it wraps.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_latency(stage, time.perf_counter() - start)
+
+    def record_queue_depth(self, depth):
+        '''
+        Record the number of tasks waiting to be evaluated.
+
+        Parameters
+        ----------
+        depth : int
+            Number of queued tasks.
+        '''
+        self._get_state()['queue_depth'] = depth
+
+    def record_boxes(self, count):
+        '''
+        Record how many boxes were found on the last frame.
+
+        Parameters
+        ----------
+        count : int
+            Number of boxes found by all commands.
+        '''
+        state = self._get_state()
+        if count > 0:
+            state['frames_without_boxes'] = 0
+        else:
+            state['frames_without_boxes'] += 1
+
+    def _lower(self, setting, minimum):
+        '''
+        Lower a setting by one step, if it is above its minimum.
+
+        Parameters
+        ----------
+        setting : str
+            Name of the setting.
+        minimum : number
+            Bound of the setting.
+
+        Returns
+        -------
+        bool
+            True if the setting changed.
+        '''
+        state = self._get_state()
+        if state[setting] <= minimum:
+            return False
+        state[setting] = max(state[setting] * self.step, minimum)
+        return True
+
+    def _raise(self, setting, maximum):
+        '''
+        Raise a setting by one step, if it is below its maximum.
+
+        Parameters
+        ----------
+        setting : str
+            Name of the setting.
+        maximum : number
+            Bound of the setting.
+
+        Returns
+        -------
+        bool
+            True if the setting changed.
+        '''
+        state = self._get_state()
+        if state[setting] >= maximum:
+            return False
+        state[setting] = min(state[setting] / self.step, maximum)
+        return True
+
+    def update(self):
+        '''
+        Adjust the settings to the recorded load. Call once per frame.
+
+        Returns
+        -------
+        bool
+            True if any setting changed.
+        '''
+        state = self._get_state()
+        state['frames_since_adjust'] += 1
+        if state['frames_since_adjust'] < self.adjust_frames:
+            return False
+
+        latency = sum(state['latencies'].values())
+        interval = self.get_frame_interval()
+        overloaded = latency > self.high_load * interval or \
+            state['queue_depth'] > self.max_queue_depth
+        headroom = latency < self.low_load * interval and \
+            state['queue_depth'] == 0
+
+        changed = False
+        if overloaded:
+            # Trade resolution for latency before dropping frames
+            changed = \
+                self._lower('detection_scale', self.min_detection_scale) or \
+                self._lower('normal_scale', self.min_normal_scale) or \
+                self._lower('fps', self.min_fps)
+        elif headroom:
+            changed = self._raise('fps', self.max_fps) or \
+                self._raise('normal_scale', self.max_normal_scale) or \
+                self._raise('detection_scale', self.max_detection_scale)
+
+        if changed:
+            state['frames_since_adjust'] = 0
+        return changed
+
+    def apply(self, commands):
+        '''
+        Set the current board and detection scales on commands.
+
+        Frames given to the commands afterwards must be normalized at
+        normal_scale, e.g. with get_whiteboard_region_normal.
+
+        Parameters
+        ----------
+        commands : list of Command
+            The configured commands.
+        '''
+        for command in commands:
+            command.set_normal_scale(self.normal_scale)
+            command.detection_scale = self.detection_scale
@@ -0,0 +1,348 @@
+'''
+Headless replay of a labelled frame corpus through the detection pipeline.
+
+Reports the precision and recall of detected boxes, corner error, and
+per-stage timings for each performance mode in one report, so speed-ups can
+be checked for accuracy regressions without opening any windows.
+
+The corpus is a directory containing the frames and a labels.yml file::
+
+    frames:
+      - image: board1.jpg
+        normalized: false  # Optional; true if already normalized
+        boxes:
+          '!SavePicture':
+            - [[x, y], [x, y], [x, y], [x, y]]
+
+Box corners are in the coordinates of the normalized board at the default
+resolution. Frames are replayed in order, so incremental detection sees them
+as a sequence.
+
+Modes are a YAML mapping from mode name to command attributes to override,
+plus an optional normal_scale for the board resolution and an optional
+color_bits to filter through a Color_Classifier lookup table with that many
+bits per channel::
+
+    baseline: {}
+    tiled: {tile_size: 512}
+    incremental: {incremental: true}
+    half: {detection_scale: 0.5}
+    lut6: {color_bits: 6}
+
+Usage::
+
+    python -m archimedes_whiteboard.replay CORPUS [--config tasks.yml]
+        [--modes modes.yml] [--iou 0.5]
+'''
+
+import argparse
+import os
+import time
+from collections import OrderedDict, defaultdict
+import cv2
+import numpy as np
+import yaml
+from archimedes_whiteboard.board_region import get_whiteboard_region_normal
+from archimedes_whiteboard.commands.color_classifier import Color_Classifier
+from archimedes_whiteboard.commands.preprocess import order_corners
+from archimedes_whiteboard.config import load_config
+
+
+def load_corpus(directory):
+    '''
+    Load a labelled frame corpus.
+
+    Parameters
+    ----------
+    directory : str path to a directory
+        Directory containing labels.yml and the frames it lists.
+
+    Returns
+    -------
+    list of 3-tuples
+        Each frame as (opencv bgr image, whether it is already normalized,
+        dict from command YAML tag to an N x 4 x 2 array of box corners).
+
+    Raises
+    ------
+    RuntimeError
+        If a listed frame cannot be read.
+    '''
+    with open(os.path.join(directory, 'labels.yml')) as f:
+        labels = yaml.safe_load(f)
+
+    corpus = []
+    for frame in labels['frames']:
+        path = os.path.join(directory, frame['image'])
+        image = cv2.imread(path)
+        if image is None:
+            raise RuntimeError('Could not read frame ' + path)
+
+        boxes = {tag: np.array(quads, np.float32).reshape(-1, 4, 2)
+                 for tag, quads in (frame.get('boxes') or {}).items()}
+        corpus.append((image, frame.get('normalized', False), boxes))
+
+    return corpus
+
+
+def _get_iou(a, b):
+    '''
+    Get the intersection over union of two bounding boxes.
+
+    Parameters
+    ----------
+    a, b : 4-tuples of numbers
+        Bounding boxes as (x min, y min, x max, y max).
+
+    Returns
+    -------
+    number in [0, 1]
+        Area of the intersection divided by area of the union.
+    '''
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0
+
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - \
+        intersection
+    return intersection / union
+
+
+def match_boxes(detected, labelled, iou_threshold=0.5):
+    '''
+    Greedily match detected boxes to labelled boxes by bounding box overlap.
+
+    Parameters
+    ----------
+    detected : numpy array
+        Detected box corners as an N x 4 x 2 array.
+    labelled : numpy array
+        Labelled box corners as an M x 4 x 2 array.
+    iou_threshold (optional) : number in [0, 1]
+        Minimum intersection over union for two boxes to match.
+
+    Returns
+    -------
+    4-tuple
+        Number of true positives, false positives, and false negatives, and
+        a list of the mean corner distance (pixels) of each match.
+    '''
+    detected_bounds = [np.concatenate([quad.min(axis=0), quad.max(axis=0)])
+                       for quad in detected]
+    labelled_bounds = [np.concatenate([quad.min(axis=0), quad.max(axis=0)])
+                       for quad in labelled]
+
+    pairs = sorted(((_get_iou(d, l), i, j)
+                    for i, d in enumerate(detected_bounds)
+                    for j, l in enumerate(labelled_bounds)), reverse=True)
+
+    used_detected, used_labelled, corner_errors = set(), set(), []
+    for iou, i, j in pairs:
+        if iou < iou_threshold:
+            break
+        if i in used_detected or j in used_labelled:
+            continue
+
+        used_detected.add(i)
+        used_labelled.add(j)
+        distances = np.linalg.norm(order_corners(detected[i]) -
+                                   order_corners(labelled[j]), axis=1)
+        corner_errors.append(float(distances.mean()))
+
+    true_positives = len(corner_errors)
+    return (true_positives, len(detected) - true_positives,
+            len(labelled) - true_positives, corner_errors)
+
+
+def run_mode(corpus, config_path, overrides=None, iou_threshold=0.5):
+    '''
+    Replay a corpus through detection in one performance mode.
+
+    Does not evaluate any tasks or block regions.
+
+    Parameters
+    ----------
+    corpus : list of 3-tuples
+        Frames from load_corpus.
+    config_path : str path to a file
+        The task configuration, e.g. tasks.yml.
+    overrides (optional) : dict or None
+        Command attributes to override, plus an optional normal_scale and
+        an optional color_bits to filter with a Color_Classifier.
+    iou_threshold (optional) : number in [0, 1]
+        Minimum intersection over union for a detected box to match.
+
+    Returns
+    -------
+    dict
+        Precision, recall, mean corner error (pixels), match counts, and the
+        mean time of each stage (seconds).
+    '''
+    overrides = dict(overrides or {})
+    normal_scale = overrides.pop('normal_scale', 1)
+    color_bits = overrides.pop('color_bits', None)
+
+    commands, _ = load_config(config_path)
+    for command in commands:
+        for name, value in overrides.items():
+            setattr(command, name, value)
+
+    classifier = None
+    if color_bits is not None:
+        classifier = Color_Classifier(commands, color_bits,
+                                      overrides.get('tile_size'),
+                                      overrides.get('num_threads'))
+
+    timings = defaultdict(list)
+    true_positives, false_positives, false_negatives = 0, 0, 0
+    corner_errors = []
+
+    for image, normalized, labels in corpus:
+        scale = 1
+        if not normalized:
+            start = time.perf_counter()
+            image = get_whiteboard_region_normal(image, scale=normal_scale)
+            timings['normalize'].append(time.perf_counter() - start)
+            scale = normal_scale
+
+        if classifier is not None:
+            start = time.perf_counter()
+            classes = classifier.classify(image)
+            timings['classify'].append(time.perf_counter() - start)
+
+        for command in commands:
+            command.set_normal_scale(scale)
+
+            start = time.perf_counter()
+            if classifier is None:
+                filtered = command.filter_image(image)
+            else:
+                filtered = classifier.get_mask(classes, command)
+            timings['filter ' + command.yaml_tag].append(
+                time.perf_counter() - start)
+
+            start = time.perf_counter()
+            quads, _ = command.find_boxes(filtered)
+            timings['detect ' + command.yaml_tag].append(
+                time.perf_counter() - start)
+
+            labelled = labels.get(command.yaml_tag, np.empty((0, 4, 2)))
+            tp, fp, fn, errors = match_boxes(quads / scale, labelled,
+                                             iou_threshold)
+            true_positives += tp
+            false_positives += fp
+            false_negatives += fn
+            corner_errors += errors
+
+    detected = true_positives + false_positives
+    expected = true_positives + false_negatives
+    return {
+        'precision': true_positives / detected if detected else 1.0,
+        'recall': true_positives / expected if expected else 1.0,
+        'corner_error': np.mean(corner_errors) if corner_errors else 0.0,
+        'true_positives': true_positives,
+        'false_positives': false_positives,
+        'false_negatives': false_negatives,
+        'timings': OrderedDict((stage, float(np.mean(times)))
+                               for stage, times in timings.items()),
+    }
+
+
+def run_replay(corpus, config_path, modes, iou_threshold=0.5):
+    '''
+    Replay a corpus through detection in several performance modes.
+
+    Parameters
+    ----------
+    corpus : list of 3-tuples
+        Frames from load_corpus.
+    config_path : str path to a file
+        The task configuration, e.g. tasks.yml.
+    modes : dict
+        Mode name to overrides, as taken by run_mode.
+    iou_threshold (optional) : number in [0, 1]
+        Minimum intersection over union for a detected box to match.
+
+    Returns
+    -------
+    OrderedDict
+        Mode name to report from run_mode.
+    '''
+    return OrderedDict((name, run_mode(corpus, config_path, overrides,
+                                       iou_threshold))
+                       for name, overrides in modes.items())
+
+
+def format_report(reports):
+    '''
+    Format replay reports as a plain text table.
+
+    Parameters
+    ----------
+    reports : dict
+        Mode name to report, from run_replay.
+
+    Returns
+    -------
+    str
+        One row per mode with accuracy and per-stage timings (ms).
+    '''
+    stages = []
+    for report in reports.values():
+        stages += [stage for stage in report['timings'] if stage not in stages]
+
+    header = ['mode', 'precision', 'recall', 'corner err', 'TP', 'FP', 'FN']
+    header += [stage + ' ms' for stage in stages]
+    rows = [header]
+    for name, report in reports.items():
+        row = [name,
+               '{:.3f}'.format(report['precision']),
+               '{:.3f}'.format(report['recall']),
+               '{:.2f}'.format(report['corner_error']),
+               str(report['true_positives']),
+               str(report['false_positives']),
+               str(report['false_negatives'])]
+        row += ['{:.1f}'.format(report['timings'][stage] * 1000)
+                if stage in report['timings'] else '-' for stage in stages]
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width)
+                               for cell, width in zip(row, widths))
+                     for row in rows)
+
+
+def main(argv=None):
+    '''
+    Run the replay harness from the command line and print the report.
+
+    Parameters
+    ----------
+    argv (optional) : list of str or None
+        Command line arguments. If None, uses sys.argv.
+    '''
+    description = __doc__.strip().split('\n')[0]
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('corpus', help='directory containing labels.yml')
+    parser.add_argument('--config', default='tasks.yml',
+                        help='task configuration file')
+    parser.add_argument('--modes', default=None,
+                        help='YAML file of performance modes to compare')
+    parser.add_argument('--iou', type=float, default=0.5,
+                        help='minimum overlap for a box to match')
+    args = parser.parse_args(argv)
+
+    modes = {'default': {}}
+    if args.modes is not None:
+        with open(args.modes) as f:
+            modes = yaml.safe_load(f)
+
+    corpus = load_corpus(args.corpus)
+    reports = run_replay(corpus, args.config, modes, args.iou)
+    print(format_report(reports))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+'''
+Runs the configured commands on a live whiteboard camera feed.
+
+On startup, blocked regions and the board's normalizing transform and marker
+crop are restored from the checkpoint, if any, so frames are normalized
+without searching for markers; they are saved again periodically while
+running and on exit. Assumes the camera does not move; delete the
+checkpoint after moving it.
+
+Each command's marker_length is measured from the crop, so pre-processing
+with marker_size set can measure the board resolution.
+
+If the config has a !Controller, it is fed each frame's stage timings, box
+count, and task queue depth, and its board resolution, detection scale, and
+capture rate are used for the following frames.
+
+Usage::
+
+    python -m archimedes_whiteboard.runner [--config tasks.yml]
+        [--camera 0] [--checkpoint output/checkpoint.bin] [--interval 1]
+        [--workers 2]
+'''
+
+import argparse
+import time
+from contextlib import nullcontext
+import cv2
+from archimedes_whiteboard.board_region import (get_marker_crop,
+                                                get_marker_length,
+                                                get_normalizing_transform,
+                                                get_whiteboard_region_normal,
+                                                normalize_image)
+from archimedes_whiteboard.checkpoint import Checkpointer
+from archimedes_whiteboard.commands.scheduler import Scheduler
+from archimedes_whiteboard.config import load_config
+
+
+class Runner():
+    '''
+    Runs the configured commands on a stream of whiteboard frames.
+
+    Parameters
+    ----------
+    config_path : str path to a file
+        The task configuration, e.g. tasks.yml.
+    checkpoint_path (optional) : str path to a file or None
+        If not None, restore state from this checkpoint on startup and save
+        it periodically.
+    checkpoint_interval (optional) : positive number
+        Minimum number of seconds between checkpoints.
+    num_workers (optional) : int
+        Number of threads evaluating regions on a Scheduler, using each
+        command's scheduling options. If 0, regions are evaluated inline.
+    '''
+
+    def __init__(self, config_path, checkpoint_path=None,
+                 checkpoint_interval=10, num_workers=2):
+        self.commands, self.controller = load_config(config_path)
+
+        self.scheduler = None
+        if num_workers > 0:
+            self.scheduler = Scheduler(num_workers)
+            for command in self.commands:
+                command.scheduler = self.scheduler
+
+        self._transform, self._crop = None, None
+        self._checkpointer = None
+        if checkpoint_path is not None:
+            self._checkpointer = Checkpointer(checkpoint_path,
+                                              checkpoint_interval)
+            self._transform, crop = self._checkpointer.restore(self.commands)
+            if crop is not None:
+                self._set_crop(crop)
+
+    def _set_crop(self, crop):
+        '''
+        Use a marker crop for the board and measure its markers.
+
+        Parameters
+        ----------
+        crop : 2-tuple
+            The crop from get_marker_crop.
+        '''
+        self._crop = crop
+        marker_length = get_marker_length(crop)
+        for command in self.commands:
+            command.marker_length = marker_length
+
+    def _time_stage(self, stage):
+        '''
+        Time a stage for the controller, if there is one.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage.
+
+        Returns
+        -------
+        context manager
+            Records the latency of the code it wraps.
+        '''
+        if self.controller is None:
+            return nullcontext()
+        return self.controller.time_stage(stage)
+
+    def _normalize(self, image, scale=1):
+        '''
+        Normalize a frame, locating the board from its markers if needed.
+
+        Parameters
+        ----------
+        image : opencv bgr image
+            A camera frame of the whiteboard.
+        scale (optional) : positive number
+            Resolution of the normalized board relative to the default.
+
+        Returns
+        -------
+        opencv bgr image or None
+            The normalized board, or None if the board has not been located
+            and its markers are not visible.
+        '''
+        if self._transform is None:
+            self._transform = get_normalizing_transform(image)
+            if self._transform is None:
+                return None
+
+        if self._crop is None:
+            crop = get_marker_crop(normalize_image(image, self._transform))
+            if crop is None:
+                return None
+            self._set_crop(crop)
+
+        return get_whiteboard_region_normal(image, self._transform, scale,
+                                            self._crop)
+
+    def process_frame(self, image):
+        '''
+        Normalize a frame and run all commands on it.
+
+        Parameters
+        ----------
+        image : opencv bgr image
+            A camera frame of the whiteboard.
+
+        Returns
+        -------
+        opencv bgr image or None
+            The normalized board, or None if the board could not be located.
+        '''
+        scale = 1
+        if self.controller is not None:
+            self.controller.apply(self.commands)
+            scale = self.controller.normal_scale
+
+        with self._time_stage('normalize'):
+            normalized = self._normalize(image, scale)
+        if normalized is None:
+            return None
+
+        boxes = 0
+        for command in self.commands:
+            with self._time_stage(command.yaml_tag):
+                boxes += command.act_on_frame(normalized)
+
+        if self.controller is not None:
+            self.controller.record_boxes(boxes)
+            if self.scheduler is not None:
+                self.controller.record_queue_depth(
+                    self.scheduler.queue_depth())
+            self.controller.update()
+
+        if self._checkpointer is not None:
+            self._checkpointer.update(self.commands, self._transform,
+                                      self._crop)
+        return normalized
+
+    def run(self, capture, frame_interval=1):
+        '''
+        Process frames from a capture until it ends, then close.
+
+        Parameters
+        ----------
+        capture : cv2.VideoCapture
+            The camera, or any object with a compatible read method.
+        frame_interval (optional) : positive number
+            Seconds between captured frames, if there is no controller to
+            set the capture rate.
+        '''
+        try:
+            while True:
+                start = time.monotonic()
+                ok, image = capture.read()
+                if not ok:
+                    break
+
+                self.process_frame(image)
+                if self.controller is not None:
+                    frame_interval = self.controller.get_frame_interval()
+                time.sleep(max(frame_interval - (time.monotonic() - start),
+                               0))
+        finally:
+            self.close()
+
+    def close(self):
+        '''
+        Finish queued regions, then save a final checkpoint.
+        '''
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+
+        if self._checkpointer is not None:
+            self._checkpointer.update(self.commands, self._transform,
+                                      self._crop, force=True)
+
+
+def main(argv=None):
+    '''
+    Run the commands on a camera from the command line.
+
+    Parameters
+    ----------
+    argv (optional) : list of str or None
+        Command line arguments. If None, uses sys.argv.
+    '''
+    description = __doc__.strip().split('\n')[0]
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--config', default='tasks.yml',
+                        help='task configuration file')
+    parser.add_argument('--camera', type=int, default=0,
+                        help='index of the camera to capture from')
+    parser.add_argument('--checkpoint', default=None,
+                        help='file to restore and save state in')
+    parser.add_argument('--interval', type=float, default=1,
+                        help='seconds between captured frames, if the '
+                        'config has no controller')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='threads evaluating regions; 0 for inline')
+    args = parser.parse_args(argv)
+
+    runner = Runner(args.config, args.checkpoint, num_workers=args.workers)
+    capture = cv2.VideoCapture(args.camera)
+    try:
+        runner.run(capture, args.interval)
+    finally:
+        capture.release()
+
+
+if __name__ == '__main__':
+    main()
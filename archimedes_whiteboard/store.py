@@ -0,0 +1,369 @@
+'''
+Persistent local store for processed command regions and their results.
+
+Region images are kept in a content-addressed blob directory, and region
+metadata and task results are appended to an indexed SQLite database, so
+that work done before a restart can be found without scanning directories.
+
+Regions are identified by a hash of their exact pixels, so work is only
+found again for an identical image. Two captures of the same unchanged
+region usually differ by camera noise; pre-processing regions, e.g. by
+binarizing them, before storing makes repeats much more likely to match.
+'''
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import cv2
+import numpy as np
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    session TEXT PRIMARY KEY,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS regions (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    session TEXT NOT NULL,
+    command TEXT NOT NULL,
+    x_min INTEGER NOT NULL,
+    y_min INTEGER NOT NULL,
+    x_max INTEGER NOT NULL,
+    y_max INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS regions_hash ON regions (hash);
+CREATE INDEX IF NOT EXISTS regions_created ON regions (created);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT,
+    session TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_hash ON results (hash, kind);
+CREATE INDEX IF NOT EXISTS results_created ON results (created);
+'''
+
+# Open stores, keyed by absolute directory
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def hash_image(image):
+    '''
+    Get a content hash of an image.
+
+    Parameters
+    ----------
+    image : opencv image
+        The image.
+
+    Returns
+    -------
+    str
+        Hex SHA-256 digest of the image's shape, type, and pixels.
+    '''
+    image = np.ascontiguousarray(image)
+    digest = hashlib.sha256()
+    digest.update('{}{}'.format(image.shape, image.dtype).encode())
+    digest.update(image.data)
+    return digest.hexdigest()
+
+
+class Region_Store():
+    '''
+    Append-only store of command regions and derived results.
+
+    Each instance is a new board session. Safe to share between threads.
+
+    Parameters
+    ----------
+    directory : str path to a directory
+        Directory holding the database and blobs. Created if missing.
+    '''
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._blob_directory = os.path.join(directory, 'blobs')
+        os.makedirs(self._blob_directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._claims = set()  # (hash, kind) of results being computed
+        self._connection = sqlite3.connect(
+            os.path.join(directory, 'regions.sqlite3'),
+            check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+
+        self.session = uuid.uuid4().hex
+        with self._lock, self._connection:
+            self._connection.execute('INSERT INTO sessions VALUES (?, ?)',
+                                     (self.session, time.time()))
+
+    def get_blob_path(self, image_hash):
+        '''
+        Get the path of a region image in the blob directory.
+
+        Parameters
+        ----------
+        image_hash : str
+            Hash of the region image, from hash_image.
+
+        Returns
+        -------
+        str
+            Path of the PNG blob. It exists if the region has been added.
+        '''
+        return os.path.join(self._blob_directory, image_hash[:2],
+                            image_hash + '.png')
+
+    def _write_blob(self, image, image_hash):
+        '''
+        Atomically write a region image to the blob directory if missing.
+
+        Parameters
+        ----------
+        image : opencv image
+            The region image.
+        image_hash : str
+            Hash of the region image.
+        '''
+        path = self.get_blob_path(image_hash)
+        if os.path.exists(path):
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        ok, encoded = cv2.imencode('.png', image)
+        if not ok:
+            raise RuntimeError('Could not encode region image')
+
+        temp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(temp_path, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.replace(temp_path, path)
+
+    def add_region(self, image, bbox, command, image_hash=None,
+                   store_image=True):
+        '''
+        Record a detected region and optionally store its image.
+
+        Parameters
+        ----------
+        image : opencv image
+            The region image.
+        bbox : 4-tuple of ints
+            Bounding box of the region on the board as
+            (x min, y min, x max, y max).
+        command : str
+            YAML tag of the command that detected the region.
+        image_hash (optional) : str or None
+            Hash of the region image, if already computed.
+        store_image (optional) : bool
+            If False, only record the region, e.g. because its image was
+            stored when it was first processed.
+
+        Returns
+        -------
+        str
+            Hash of the region image.
+        '''
+        if image_hash is None:
+            image_hash = hash_image(image)
+        if store_image:
+            self._write_blob(image, image_hash)
+
+        x_min, y_min, x_max, y_max = (int(x) for x in bbox)
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO regions (hash, session, command, x_min, y_min, '
+                'x_max, y_max, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (image_hash, self.session, command, x_min, y_min, x_max,
+                 y_max, time.time()))
+        return image_hash
+
+    def claim(self, image_hash, kind):
+        '''
+        Atomically claim the work of computing a result for a region.
+
+        Fails if the result exists, in any session, or another thread holds
+        the claim. The claim is held until add_result or release is called
+        for the same region and kind.
+
+        Parameters
+        ----------
+        image_hash : str
+            Hash of the region image.
+        kind : str
+            Kind of the result.
+
+        Returns
+        -------
+        bool
+            True if the caller now holds the claim and should compute the
+            result.
+        '''
+        with self._lock:
+            if (image_hash, kind) in self._claims:
+                return False
+            row = self._connection.execute(
+                'SELECT 1 FROM results WHERE hash = ? AND kind = ? LIMIT 1',
+                (image_hash, kind)).fetchone()
+            if row is not None:
+                return False
+            self._claims.add((image_hash, kind))
+        return True
+
+    def release(self, image_hash, kind):
+        '''
+        Give up a claim without recording a result, e.g. if the work failed.
+
+        Parameters
+        ----------
+        image_hash : str
+            Hash of the region image.
+        kind : str
+            Kind of the result.
+        '''
+        with self._lock:
+            self._claims.discard((image_hash, kind))
+
+    def add_result(self, image_hash, kind, value=None):
+        '''
+        Record a result derived from a region, releasing any claim on it.
+
+        Parameters
+        ----------
+        image_hash : str
+            Hash of the region image.
+        kind : str
+            Kind of the result, e.g. a command's YAML tag, 'latex', or
+            'mathematica'.
+        value (optional) : str or None
+            The result, or None to only record that the work was done.
+        '''
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO results (hash, kind, value, session, created) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (image_hash, kind, value, self.session, time.time()))
+            self._claims.discard((image_hash, kind))
+
+    def has_result(self, image_hash, kind):
+        '''
+        Check if a result has been recorded for a region, in any session.
+
+        Parameters
+        ----------
+        image_hash : str
+            Hash of the region image.
+        kind : str
+            Kind of the result.
+
+        Returns
+        -------
+        bool
+            True if a result of this kind exists for the region.
+        '''
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM results WHERE hash = ? AND kind = ? LIMIT 1',
+                (image_hash, kind)).fetchone()
+        return row is not None
+
+    def get_results(self, image_hash, kind=None):
+        '''
+        Get all results recorded for a region, oldest first.
+
+        Parameters
+        ----------
+        image_hash : str
+            Hash of the region image.
+        kind (optional) : str or None
+            If not None, only get results of this kind.
+
+        Returns
+        -------
+        list of 3-tuples
+            Results as (kind, value, created timestamp).
+        '''
+        query = 'SELECT kind, value, created FROM results WHERE hash = ?'
+        args = (image_hash,)
+        if kind is not None:
+            query += ' AND kind = ?'
+            args += (kind,)
+
+        with self._lock:
+            return self._connection.execute(query + ' ORDER BY created',
+                                            args).fetchall()
+
+    def get_regions(self, start=None, end=None, session=None):
+        '''
+        Get recorded regions, oldest first.
+
+        Parameters
+        ----------
+        start (optional) : number or None
+            If not None, only get regions recorded at or after this Unix time.
+        end (optional) : number or None
+            If not None, only get regions recorded before this Unix time.
+        session (optional) : str or None
+            If not None, only get regions recorded in this session.
+
+        Returns
+        -------
+        list of tuples
+            Regions as (hash, session, command, x min, y min, x max, y max,
+            created timestamp).
+        '''
+        query = 'SELECT hash, session, command, x_min, y_min, x_max, ' \
+            'y_max, created FROM regions WHERE 1'
+        args = ()
+        if start is not None:
+            query += ' AND created >= ?'
+            args += (start,)
+        if end is not None:
+            query += ' AND created < ?'
+            args += (end,)
+        if session is not None:
+            query += ' AND session = ?'
+            args += (session,)
+
+        with self._lock:
+            return self._connection.execute(query + ' ORDER BY created',
+                                            args).fetchall()
+
+    def close(self):
+        '''
+        Close the database connection.
+        '''
+        with self._lock:
+            self._connection.close()
+
+
+def get_store(directory):
+    '''
+    Get the open Region_Store for a directory, opening it if needed.
+
+    Parameters
+    ----------
+    directory : str path to a directory
+        Directory holding the store.
+
+    Returns
+    -------
+    Region_Store
+        The store, shared by all commands using the same directory.
+    '''
+    directory = os.path.abspath(directory)
+    with _STORES_LOCK:
+        if directory not in _STORES:
+            _STORES[directory] = Region_Store(directory)
+        return _STORES[directory]
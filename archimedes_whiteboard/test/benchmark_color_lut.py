@@ -0,0 +1,63 @@
+'''
+Benchmark lookup table color filtering against cvtColor and inRange.
+
+Runs on the CPU only. Checks that the exact table matches filter_to_color
+and prints the time per frame of each approach for all commands.
+'''
+
+import time
+import cv2
+import numpy as np
+from archimedes_whiteboard.commands.color_classifier import Color_Classifier
+from archimedes_whiteboard.board_region import get_whiteboard_region_normal
+from archimedes_whiteboard.config import load_config
+
+REPEATS = 10
+
+cv2.ocl.setUseOpenCL(False)
+
+img = cv2.imread('../sample_images/sideangle_highres.jpg')
+normalized = get_whiteboard_region_normal(img)
+commands, _ = load_config('../tasks.yml')
+
+
+def time_per_frame(function):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        function()
+    return (time.perf_counter() - start) / REPEATS
+
+
+def filter_hsv():
+    return [command.filter_image(normalized) for command in commands]
+
+
+print('Board size: {}x{}, {} commands'.format(len(normalized[0]),
+                                              len(normalized),
+                                              len(commands)))
+print('cvtColor + inRange: {:.1f} ms'.format(
+    time_per_frame(filter_hsv) * 1000))
+
+for bits in [8, 6, 5]:
+    start = time.perf_counter()
+    classifier = Color_Classifier(commands, bits)
+    build_time = time.perf_counter() - start
+
+    def filter_lut():
+        classes = classifier.classify(normalized)
+        return [classifier.get_mask(classes, command) for command in commands]
+
+    mismatched = sum(np.count_nonzero(a != b)
+                     for a, b in zip(filter_hsv(), filter_lut()))
+    print('{}-bit table: {:.1f} ms (built in {:.2f} s), {} pixels differ'
+          .format(bits, time_per_frame(filter_lut) * 1000, build_time,
+                  mismatched))
+
+    if bits == 8:
+        assert mismatched == 0, 'Exact table does not match filter_to_color'
+
+# Tiled classification should match too
+assert np.array_equal(
+    Color_Classifier(commands, tile_size=512).classify(normalized),
+    Color_Classifier(commands).classify(normalized)), \
+    'Tiled classification does not match'
@@ -0,0 +1,71 @@
+'''
+Benchmark tiled color filtering and box detection.
+
+Checks that the tiled results match the untiled results exactly and prints
+the speedup for each number of threads.
+'''
+
+import os
+import time
+import cv2
+import numpy as np
+from archimedes_whiteboard.commands import region_extraction
+from archimedes_whiteboard.board_region import get_whiteboard_region_normal
+
+TILE_SIZE = 512
+REPEATS = 10
+
+img = cv2.imread('../sample_images/sideangle_highres.jpg')
+normalized = get_whiteboard_region_normal(img)
+
+
+def detect(tile_size=None, num_threads=None):
+    filtered = region_extraction.filter_to_color(normalized, 180,
+                                                 tol_hue=20,
+                                                 min_saturation=30,
+                                                 min_value=150,
+                                                 tile_size=tile_size,
+                                                 num_threads=num_threads)
+    boxes = region_extraction.get_rectangular_boxes(filtered,
+                                                    tile_size=tile_size,
+                                                    num_threads=num_threads)
+    return filtered, boxes
+
+
+def get_mask(filtered, tile_size=None, num_threads=None):
+    # Not timed; get_rectangular_boxes computes the mask itself
+    return region_extraction.get_box_mask(filtered, tile_size=tile_size,
+                                          num_threads=num_threads)
+
+
+def time_detect(tile_size=None, num_threads=None):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        detect(tile_size, num_threads)
+    return (time.perf_counter() - start) / REPEATS
+
+
+base_filtered, base_boxes = detect()
+base_mask = get_mask(base_filtered)
+contours = cv2.findContours(base_mask.copy(), cv2.RETR_EXTERNAL,
+                            cv2.CHAIN_APPROX_SIMPLE)[1]
+assert np.array_equal(region_extraction.get_contour_areas(contours),
+                      [cv2.contourArea(contour) for contour in contours]), \
+    'Contour area mismatch'
+base_time = time_detect()
+print('Board size: {}x{}'.format(len(normalized[0]), len(normalized)))
+print('Untiled: {:.1f} ms'.format(base_time * 1000))
+
+for num_threads in range(1, (os.cpu_count() or 1) + 1):
+    filtered, boxes = detect(TILE_SIZE, num_threads)
+    assert np.array_equal(filtered, base_filtered), 'Filter mismatch'
+    assert np.array_equal(get_mask(filtered, TILE_SIZE, num_threads),
+                          base_mask), 'Mask mismatch'
+    assert len(boxes) == len(base_boxes) and \
+        all(np.array_equal(a, b) for a, b in zip(boxes, base_boxes)), \
+        'Box mismatch'
+
+    tiled_time = time_detect(TILE_SIZE, num_threads)
+    speedup = base_time / tiled_time
+    print('{} threads: {:.1f} ms, speedup {:.2f}x ({:.2f}x per core)'.format(
+        num_threads, tiled_time * 1000, speedup, speedup / num_threads))
@@ -0,0 +1,82 @@
+'''
+Test incremental box tracking against full box detection.
+
+Checks that the tracker finds exactly the boxes of full detection on a
+sequence of frames, then prints the time per update for changes of
+increasing size next to the time of full detection.
+'''
+
+import time
+import cv2
+from archimedes_whiteboard.commands import region_extraction
+from archimedes_whiteboard.commands.box_tracker import Box_Tracker
+from archimedes_whiteboard.board_region import get_whiteboard_region_normal
+
+REPEATS = 10
+
+
+def box_set(boxes):
+    return sorted(tuple(map(tuple, box.reshape(-1, 2).tolist()))
+                  for box in boxes)
+
+
+def filter_frame(frame):
+    return region_extraction.filter_to_color(frame, 180, 20, 30, 150)
+
+
+def draw_boxes(frame, right, bottom):
+    # Draw a grid of boxes over the board up to (right, bottom)
+    frame = frame.copy()
+    for x in range(50, right - 250, 300):
+        for y in range(50, bottom - 200, 250):
+            cv2.rectangle(frame, (x, y), (x + 200, y + 150), (255, 0, 255),
+                          thickness=8)
+    return frame
+
+
+img = cv2.imread('../sample_images/sideangle_highres.jpg')
+normalized = get_whiteboard_region_normal(img)
+height, width = normalized.shape[:2]
+tracker = Box_Tracker()
+
+# Draw a new box, then erase an existing one
+drawn = cv2.rectangle(normalized.copy(), (100, 100), (400, 300),
+                      (255, 0, 255), thickness=8)
+erased = region_extraction.get_rectangular_boxes(filter_frame(normalized))[:1]
+erased = cv2.fillPoly(drawn.copy(), erased, (255, 255, 255))
+
+for frame in [normalized, normalized, drawn, erased, normalized]:
+    filtered = filter_frame(frame)
+    full = region_extraction.get_rectangular_boxes(filtered)
+    incremental = tracker.update(filtered)
+    assert box_set(full) == box_set(incremental), 'Box mismatch'
+print('Boxes match full detection')
+
+# Alternate between the board and a changed board, timing each update
+base = filter_frame(normalized)
+changes = [('No change', base),
+           ('One box', filter_frame(drawn)),
+           ('Quarter of board', filter_frame(
+               draw_boxes(normalized, width // 2, height // 2))),
+           ('Whole board', filter_frame(
+               draw_boxes(normalized, width, height)))]
+
+start = time.perf_counter()
+for _ in range(REPEATS):
+    region_extraction.get_rectangular_boxes(base)
+full_time = (time.perf_counter() - start) / REPEATS
+print('Full detection: {:.1f} ms'.format(full_time * 1000))
+
+for name, changed in changes:
+    expected = [box_set(region_extraction.get_rectangular_boxes(frame))
+                for frame in [changed, base]]
+    tracker.update(base)
+
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        boxes = [box_set(tracker.update(frame)) for frame in [changed, base]]
+    update_time = (time.perf_counter() - start) / (2 * REPEATS)
+
+    assert boxes == expected, 'Box mismatch for ' + name
+    print('{}: {:.1f} ms per update ({:.0%} of full detection)'.format(
+        name, update_time * 1000, update_time / full_time))
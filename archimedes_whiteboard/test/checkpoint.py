@@ -0,0 +1,81 @@
+'''
+Test checkpointing and restoring blocked regions.
+
+Checks that a restart restores the normalizing transform, the marker crop,
+and every command's blocked regions, and that restored state normalizes
+frames identically without searching for markers.
+'''
+
+import cv2
+import numpy as np
+from archimedes_whiteboard.board_region import (get_marker_crop,
+                                                get_normalizing_transform,
+                                                get_whiteboard_region_normal,
+                                                normalize_image)
+from archimedes_whiteboard.checkpoint import Checkpointer
+from archimedes_whiteboard.config import load_config
+from archimedes_whiteboard.runner import Runner
+
+CHECKPOINT = '../output/checkpoint.bin'
+
+img = cv2.imread('../sample_images/sideangle_highres.jpg')
+transform = get_normalizing_transform(img)
+crop = get_marker_crop(normalize_image(img, transform))
+normalized = get_whiteboard_region_normal(img, transform)
+assert crop is not None, 'No markers found'
+assert np.array_equal(get_whiteboard_region_normal(img, transform, crop=crop),
+                      normalized), 'Crop does not match marker search'
+
+commands, _ = load_config('../tasks.yml')
+for task in commands:
+    task.act_on_frame(normalized)  # Should act on all boxes
+
+checkpointer = Checkpointer(CHECKPOINT, interval=0)
+assert checkpointer.update(commands, transform, crop), 'Checkpoint not saved'
+assert not Checkpointer(CHECKPOINT).update(commands, transform, crop), \
+    'Checkpoint saved before the interval passed'
+
+# Simulate a restart
+restarted, _ = load_config('../tasks.yml')
+restored_transform, restored_crop = Checkpointer(CHECKPOINT).restore(restarted)
+
+assert np.array_equal(restored_transform, transform), 'Transform mismatch'
+assert restored_crop == crop, 'Crop mismatch'
+for task, restored in zip(commands, restarted):
+    saved_state, restored_state = task.get_state(), restored.get_state()
+    assert len(saved_state) == len(restored_state), 'Region count mismatch'
+    for (corners, cooldown, clear), (r_corners, r_cooldown, r_clear) in \
+            zip(saved_state, restored_state):
+        assert np.array_equal(np.reshape(corners, (4, 2)),
+                              np.reshape(r_corners, (4, 2))), \
+            'Region corners mismatch'
+        assert (cooldown, clear) == (r_cooldown, r_clear), \
+            'Region counters mismatch'
+print('Transform, crop, and blocked regions restored')
+
+normalized = get_whiteboard_region_normal(img, restored_transform,
+                                         crop=restored_crop)
+for task in restarted:
+    blocked = len(task.blocked_regions)
+    task.act_on_frame(normalized)  # Should do nothing
+    assert len(task.blocked_regions) == blocked, 'Restored region acted on'
+print('Restored regions stay blocked')
+
+# The runner restores the same state on startup
+runner = Runner('../tasks.yml', CHECKPOINT)
+assert np.array_equal(runner.process_frame(img), normalized), \
+    'Runner normalized differently'
+assert [len(task.blocked_regions) for task in runner.commands] == \
+    [len(task.blocked_regions) for task in restarted]
+assert all(task.marker_length for task in runner.commands), \
+    'Runner did not measure the markers'
+print('Runner restores the checkpoint on startup')
+
+# Regions still waiting for a scheduled evaluation are not checkpointed
+task = restarted[0]
+block = task._make_block_region([(0, 0), (50, 0), (50, 50), (0, 50)])
+block.set_pending(True)
+task.blocked_regions.append(block)
+assert len(task.get_state()) == len(task.blocked_regions) - 1, \
+    'Pending region checkpointed'
+print('Pending regions are left out of checkpoints')
@@ -2,15 +2,13 @@
 Test the commands backend and config loading.
 '''
 
-import yaml
 import cv2
-from archimedes_whiteboard.commands.tasks import save_picture  # NOQA
 from archimedes_whiteboard.board_region import get_whiteboard_region_normal
+from archimedes_whiteboard.config import load_config
 
 img = cv2.imread('../sample_images/sideangle_highres.jpg')
 normalized = get_whiteboard_region_normal(img)
 
-with open('../tasks.yml') as config:
-    commands = list(yaml.load_all(config))
-    for task in commands:
-        task.act_on_frame(normalized)
+commands, _ = load_config('../tasks.yml')
+for task in commands:
+    task.act_on_frame(normalized)
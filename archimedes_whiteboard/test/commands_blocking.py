@@ -2,17 +2,15 @@
 Test the commands backend and region blocking.
 '''
 
-import yaml
 import cv2
-from archimedes_whiteboard.commands.tasks import save_picture  # NOQA
 from archimedes_whiteboard.board_region import get_whiteboard_region_normal
+from archimedes_whiteboard.config import load_config
 
 img = cv2.imread('../sample_images/sideangle_highres.jpg')
 normalized = get_whiteboard_region_normal(img)
 
-with open('../tasks.yml') as config:
-    commands = list(yaml.load_all(config))
-    command = commands[0]
+commands, _ = load_config('../tasks.yml')
+command = commands[0]
 
 command.cooldown_frames = 3
 command.block_clear_frames = 3
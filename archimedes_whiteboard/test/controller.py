@@ -0,0 +1,108 @@
+'''
+Test the adaptive controller on a scripted load sequence.
+
+Checks that under load the controller lowers the detection scale, then the
+board resolution, then the frame rate, that it raises them in the opposite
+order once there is headroom, and that applying the board resolution to
+commands keeps their blocked regions and detection sizes in step, and that
+the runner feeds the controller and applies its settings.
+'''
+
+from itertools import groupby
+import cv2
+import numpy as np
+from archimedes_whiteboard.commands.command import Command
+from archimedes_whiteboard.controller import Adaptive_Controller
+from archimedes_whiteboard.runner import Runner
+
+SETTINGS = ['detection_scale', 'normal_scale', 'fps']
+
+
+def run(controller, frames, latency, queue_depth=0, boxes=1):
+    # Feed the controller a constant load and list the settings it changes
+    changes = []
+    for _ in range(frames):
+        controller.record_latency('frame', latency)
+        controller.record_queue_depth(queue_depth)
+        controller.record_boxes(boxes)
+        before = [getattr(controller, name) for name in SETTINGS]
+        if controller.update():
+            changes += [name for name, value in zip(SETTINGS, before)
+                        if getattr(controller, name) != value]
+    return [name for name, _ in groupby(changes)]
+
+
+controller = Adaptive_Controller()
+controller.smoothing = 1  # Use each latency as is
+
+# Overloaded: every frame takes far longer than the capture interval
+assert run(controller, 200, latency=10) == SETTINGS, 'Wrong lowering order'
+assert controller.detection_scale == controller.min_detection_scale
+assert controller.normal_scale == controller.min_normal_scale
+assert controller.fps == controller.min_fps
+assert run(controller, 20, latency=10) == [], 'Lowered past the minimum'
+print('Settings lowered in order: ' + ', '.join(SETTINGS))
+
+# Idle: frames are fast and nothing is queued
+assert run(controller, 200, latency=0) == SETTINGS[::-1], \
+    'Wrong raising order'
+assert controller.detection_scale == controller.max_detection_scale
+assert controller.normal_scale == controller.max_normal_scale
+assert controller.fps == controller.max_fps
+print('Settings raised in order: ' + ', '.join(SETTINGS[::-1]))
+
+# A backed up task queue counts as load even when frames are fast
+assert run(controller, controller.adjust_frames, latency=0,
+           queue_depth=controller.max_queue_depth + 1) == SETTINGS[:1]
+
+# Adjustments are spaced by adjust_frames
+controller = Adaptive_Controller()
+adjustments = 0
+for _ in range(3 * controller.adjust_frames):
+    controller.record_latency('frame', 10)
+    adjustments += controller.update()
+assert adjustments == 3, 'Adjusted too often'
+
+# An empty board drops to the idle frame rate
+controller = Adaptive_Controller()
+run(controller, controller.idle_frames, latency=0, boxes=0)
+assert controller.fps == min(controller.max_fps, controller.idle_fps)
+run(controller, 1, latency=0, boxes=1)
+assert controller.fps == controller.max_fps
+print('Idle frame rate used on an empty board')
+
+# Applying the board resolution rescales blocked regions and detection
+command = Command()
+command.target_hue = 180
+command.blocked_regions = [command._make_block_region(
+    [(100, 100), (300, 100), (300, 200), (100, 200)])]
+full_size = command._get_detection_parameters()
+
+controller = Adaptive_Controller()
+controller.smoothing = 1
+while controller.normal_scale > controller.min_normal_scale:
+    run(controller, 1, latency=10)
+controller.apply([command])
+
+scale = controller.normal_scale * controller.detection_scale
+corners, _, _ = command.blocked_regions[0].get_state()
+assert np.allclose(corners, np.multiply(
+    [(100, 100), (300, 100), (300, 200), (100, 200)],
+    controller.normal_scale), atol=1), 'Blocked region not rescaled'
+assert command._get_detection_parameters()[0] == \
+    int(full_size[0] * scale * scale), 'Detection size not rescaled'
+
+controller.apply([command])  # Applying the same scale changes nothing
+assert np.array_equal(command.blocked_regions[0].get_state()[0], corners)
+print('Blocked regions and detection sizes follow the board resolution')
+
+# The runner times each frame and applies the controller's settings
+runner = Runner('../tasks.yml', num_workers=0)
+runner.controller.adjust_frames = 1
+runner.controller.high_load = 0  # Any latency is too slow
+img = cv2.imread('../sample_images/sideangle_highres.jpg')
+runner.process_frame(img)
+runner.process_frame(img)
+assert all(command.detection_scale < 1 for command in runner.commands), \
+    'Runner did not apply the controller'
+print('Runner feeds and applies the controller')
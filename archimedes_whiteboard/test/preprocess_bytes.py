@@ -0,0 +1,62 @@
+'''
+Compare the size of raw and pre-processed command regions.
+
+Prints the PNG size of each box detected in the sample image before and
+after pre-processing, with the board resolution measured from the markers.
+'''
+
+import cv2
+from archimedes_whiteboard.board_region import (get_marker_crop,
+                                                get_marker_length,
+                                                get_normalizing_transform,
+                                                get_whiteboard_region_normal,
+                                                normalize_image)
+from archimedes_whiteboard.commands.preprocess import Region_Preprocessor
+from archimedes_whiteboard.config import load_config
+from archimedes_whiteboard.store import hash_image
+
+MARKER_SIZE = 4  # Printed marker side length (inches)
+TARGET_DPI = 75
+
+
+def png_bytes(image):
+    return len(cv2.imencode('.png', image)[1])
+
+
+img = cv2.imread('../sample_images/sideangle_highres.jpg')
+transform = get_normalizing_transform(img)
+crop = get_marker_crop(normalize_image(img, transform))
+normalized = get_whiteboard_region_normal(img, transform, crop=crop)
+marker_length = get_marker_length(crop)
+
+commands, _ = load_config('../tasks.yml')
+for command in commands:
+    preprocessor = Region_Preprocessor(command.target_hue,
+                                       command.tol_hue,
+                                       command.min_saturation,
+                                       command.min_value,
+                                       deskew=True,
+                                       remove_border=True,
+                                       marker_size=MARKER_SIZE,
+                                       target_dpi=TARGET_DPI,
+                                       binarize=True)
+    print('{}: board measured at {:.0f} dpi'.format(
+        command.yaml_tag, preprocessor.get_board_dpi(
+            marker_length=marker_length)))
+
+    raw_total, processed_total = 0, 0
+    quads, bounds = command.detect_boxes(normalized)
+    for quad, (x_min, y_min, x_max, y_max) in zip(quads, bounds.tolist()):
+        region = normalized[y_min:y_max, x_min:x_max]
+        processed = preprocessor.process(region, quad - (x_min, y_min),
+                                         hash_image(region),
+                                         marker_length=marker_length)
+        raw, small = png_bytes(region), png_bytes(processed)
+        raw_total += raw
+        processed_total += small
+        print('  Box at ({}, {}): {} -> {} bytes ({:.0%})'.format(
+            x_min, y_min, raw, small, small / raw))
+
+    if raw_total:
+        print('  Total: {} -> {} bytes ({:.0%})'.format(
+            raw_total, processed_total, processed_total / raw_total))
@@ -0,0 +1,60 @@
+'''
+Test the replay harness on synthetic frames with known boxes.
+
+Draws boxes of the SavePicture color on blank normalized boards, writes them
+to a temporary corpus, and checks that every performance mode finds exactly
+the drawn boxes.
+'''
+
+import os
+import tempfile
+from collections import OrderedDict
+import cv2
+import numpy as np
+import yaml
+from archimedes_whiteboard.replay import format_report, load_corpus, run_replay
+
+COLOR = (85, 0, 255)  # Hue 170, inside the SavePicture color band
+BOARD_SIZE = (900, 1200)
+MODES = OrderedDict([('default', {}),
+                     ('tiled', {'tile_size': 256}),
+                     ('incremental', {'incremental': True}),
+                     ('lookup', {'color_bits': 8})])
+
+# Boxes on each frame as (x min, y min, x max, y max); replayed in order, so
+# boxes are drawn, kept, and erased across frames
+FRAMES = [
+    [(100, 100, 400, 300)],
+    [(100, 100, 400, 300), (650, 400, 950, 650)],
+    [(650, 400, 950, 650), (150, 500, 450, 780)],
+    [],
+]
+
+directory = tempfile.mkdtemp()
+labels = {'frames': []}
+for i, boxes in enumerate(FRAMES):
+    image = np.full(BOARD_SIZE + (3,), 255, np.uint8)
+    quads = []
+    for x_min, y_min, x_max, y_max in boxes:
+        cv2.rectangle(image, (x_min, y_min), (x_max, y_max), COLOR,
+                      thickness=8)
+        cv2.putText(image, 'x^2', (x_min + 40, y_max - 40),
+                    cv2.FONT_HERSHEY_SIMPLEX, 2, (30, 30, 30), thickness=4)
+        quads.append([[x_min, y_min], [x_max, y_min], [x_max, y_max],
+                      [x_min, y_max]])
+
+    name = 'frame{}.png'.format(i)
+    cv2.imwrite(os.path.join(directory, name), image)
+    labels['frames'].append({'image': name, 'normalized': True,
+                             'boxes': {'!SavePicture': quads}})
+
+with open(os.path.join(directory, 'labels.yml'), 'w') as f:
+    yaml.safe_dump(labels, f)
+
+reports = run_replay(load_corpus(directory), '../tasks.yml', MODES)
+print(format_report(reports))
+
+for name, report in reports.items():
+    assert report['precision'] == 1.0, 'False positives in ' + name
+    assert report['recall'] == 1.0, 'Missed boxes in ' + name
+    assert report['true_positives'] == sum(len(boxes) for boxes in FRAMES)
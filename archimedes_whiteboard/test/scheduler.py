@@ -0,0 +1,169 @@
+'''
+Test scheduling command regions on worker threads.
+
+Checks the run order by priority and deadline, each overflow policy,
+dropping jobs past their deadline, cancelling the jobs of an erased region,
+and that a command runs one region at a time by default.
+'''
+
+import threading
+import time
+from archimedes_whiteboard.commands.scheduler import Scheduler
+
+
+class Recording_Command():
+    '''
+    Stand-in for a command that logs the regions it evaluates.
+    '''
+
+    yaml_tag = u'!Recording'
+    normal_scale = 1
+
+    def __init__(self, log, priority=0, deadline=None, max_queue=8,
+                 overflow='drop_oldest', max_concurrent=1, gate=None):
+        self.log = log
+        self.priority = priority
+        self.deadline = deadline
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.max_concurrent = max_concurrent
+        self.gate = gate
+        self.running = 0
+        self.most_running = 0
+        self._lock = threading.Lock()
+
+    def _process_region(self, region, bbox, corners, normal_scale=1):
+        with self._lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        if self.gate is not None:
+            self.gate.wait()
+        time.sleep(0.01)
+        with self._lock:
+            self.log.append(region)
+            self.running -= 1
+
+
+class Block():
+    '''
+    Stand-in for a Block_Region.
+    '''
+
+    erased = False
+    pending = True
+
+    def is_erased(self):
+        return self.erased
+
+    def set_pending(self, pending):
+        self.pending = pending
+
+
+def run_held(queue_jobs, num_workers=1):
+    # Queue jobs while all workers are busy, then run them all
+    scheduler = Scheduler(num_workers)
+    gate = threading.Event()
+    blocker = Recording_Command([], max_concurrent=None, gate=gate)
+    for _ in range(num_workers):
+        scheduler.submit(blocker, 'blocker', (0, 0, 1, 1), None)
+    while blocker.running < num_workers:
+        time.sleep(0.001)
+
+    queue_jobs(scheduler)
+    gate.set()
+    scheduler.shutdown()
+    return scheduler
+
+
+def box(x):
+    return (x, 0, x + 10, 10)
+
+
+# Highest priority first, then earliest deadline, then oldest
+log = []
+low = Recording_Command(log)
+high = Recording_Command(log, priority=10)
+urgent = Recording_Command(log, deadline=5)
+later = Recording_Command(log, deadline=60)
+run_held(lambda scheduler: [
+    scheduler.submit(low, 'low 1', box(0), None),
+    scheduler.submit(later, 'later', box(20), None),
+    scheduler.submit(low, 'low 2', box(40), None),
+    scheduler.submit(urgent, 'urgent', box(60), None),
+    scheduler.submit(high, 'high', box(80), None)])
+assert log == ['high', 'urgent', 'later', 'low 1', 'low 2'], log
+print('Jobs run by priority, then deadline')
+
+# Overflow policies with a queue of two
+log = []
+dropping = Recording_Command(log, max_queue=2)
+scheduler = run_held(lambda scheduler: [
+    scheduler.submit(dropping, region, box(20 * i), None)
+    for i, region in enumerate(['a', 'b', 'c'])])
+assert log == ['b', 'c'] and scheduler.stats['dropped'] == 1, log
+
+log = []
+rejecting = Recording_Command(log, max_queue=2, overflow='reject')
+accepted = []
+scheduler = run_held(lambda scheduler: accepted.extend(
+    scheduler.submit(rejecting, region, box(20 * i), None)
+    for i, region in enumerate(['a', 'b', 'c'])))
+assert accepted == [True, True, False] and log == ['a', 'b'], log
+assert scheduler.stats['rejected'] == 1
+
+log = []
+coalescing = Recording_Command(log, max_queue=2, overflow='coalesce')
+scheduler = run_held(lambda scheduler: [
+    scheduler.submit(coalescing, 'a', box(0), None),
+    scheduler.submit(coalescing, 'b', box(20), None),
+    scheduler.submit(coalescing, 'b again', box(25), None),  # Overlaps b
+    scheduler.submit(coalescing, 'c', box(100), None)])  # Overlaps none
+assert log == ['b again', 'c'], log
+assert scheduler.stats['coalesced'] == 1 and scheduler.stats['dropped'] == 1
+print('Overflow policies drop, reject, and coalesce')
+
+# Jobs past their deadline never run
+log = []
+expiring = Recording_Command(log, deadline=0.01)
+scheduler = run_held(lambda scheduler: [
+    scheduler.submit(expiring, 'expired', box(0), None),
+    time.sleep(0.05)])
+assert log == [] and scheduler.stats['stale'] == 1, log
+print('Jobs past their deadline are dropped')
+
+# Jobs for erased regions are cancelled or skipped
+log = []
+command = Recording_Command(log)
+kept, cancelled, erased = Block(), Block(), Block()
+cancelled_count = []
+
+
+def queue_with_blocks(scheduler):
+    scheduler.submit(command, 'kept', box(0), None, kept)
+    scheduler.submit(command, 'cancelled 1', box(20), None, cancelled)
+    scheduler.submit(command, 'cancelled 2', box(40), None, cancelled)
+    scheduler.submit(command, 'erased', box(60), None, erased)
+    cancelled_count.append(scheduler.cancel(cancelled))
+    erased.erased = True
+
+
+scheduler = run_held(queue_with_blocks)
+assert log == ['kept'] and cancelled_count == [2], log
+assert scheduler.stats['stale'] == 3
+assert not kept.pending and cancelled.pending and erased.pending, \
+    'Only completed regions should stop pending'
+print('Jobs for erased regions are dropped')
+
+# By default a command occupies one worker at a time, leaving the rest free
+log = []
+serial = Recording_Command(log)
+other = Recording_Command(log)
+jobs = [(serial, 's1'), (serial, 's2'), (serial, 's3'), (other, 'o1'),
+        (other, 'o2')]
+scheduler = run_held(lambda scheduler: [
+    scheduler.submit(command, region, box(20 * i), None)
+    for i, (command, region) in enumerate(jobs)], num_workers=3)
+assert serial.most_running == 1 and other.most_running == 1
+assert sorted(log) == ['o1', 'o2', 's1', 's2', 's3'], log
+assert scheduler.stats['completed'] == 5 + 3
+print('Each command runs one region at a time')
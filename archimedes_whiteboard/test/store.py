@@ -0,0 +1,92 @@
+'''
+Test recording regions and results in the region store.
+
+Checks that results are found again after a restart, that a region a
+command has already processed is neither evaluated nor stored again, and
+that regions are stored after pre-processing.
+'''
+
+import os
+import tempfile
+import cv2
+import numpy as np
+from archimedes_whiteboard.commands.command import Command
+from archimedes_whiteboard.store import Region_Store, get_store, hash_image
+
+
+class Counting_Command(Command):
+    '''
+    Command that counts the regions it evaluates.
+    '''
+
+    yaml_tag = u'!CountingCommand'
+    target_hue = 180
+    evaluated = 0
+
+    def _evaluate(self, command_region):
+        self.evaluated += 1
+        return 'shape {}'.format(command_region.shape)
+
+
+def count_blobs(directory):
+    return sum(len(files) for _, _, files in
+               os.walk(os.path.join(directory, 'blobs')))
+
+
+directory = tempfile.mkdtemp()
+region = np.full((120, 160, 3), 255, np.uint8)
+cv2.putText(region, 'x + 1', (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 1.5,
+            (40, 40, 40), thickness=3)
+bbox = (200, 100, 360, 220)
+corners = np.array([(200, 100), (360, 100), (360, 220), (200, 220)])
+
+# Direct use of the store
+store = Region_Store(directory)
+image_hash = store.add_region(region, bbox, '!Test')
+assert image_hash == hash_image(region)
+assert os.path.exists(store.get_blob_path(image_hash))
+assert not store.has_result(image_hash, '!Test')
+assert store.claim(image_hash, '!Test')
+assert not store.claim(image_hash, '!Test'), 'Claimed twice'
+store.add_result(image_hash, '!Test', 'done')
+assert not store.claim(image_hash, '!Test'), 'Claimed a finished result'
+assert store.claim(image_hash, 'latex')
+store.release(image_hash, 'latex')
+assert store.claim(image_hash, 'latex'), 'Released claim not reusable'
+store.release(image_hash, 'latex')
+assert store.has_result(image_hash, '!Test')
+assert not store.has_result(image_hash, 'latex')
+assert [value for _, value, _ in store.get_results(image_hash)] == ['done']
+assert len(store.get_regions(session=store.session)) == 1
+store.close()
+
+# A new session finds the earlier result
+restarted = Region_Store(directory)
+assert restarted.session != store.session
+assert restarted.has_result(image_hash, '!Test')
+assert restarted.get_regions(session=restarted.session) == []
+restarted.close()
+print('Store results survive a restart')
+
+# A command evaluates and stores each distinct region once
+command = Counting_Command()
+command.store_directory = tempfile.mkdtemp()
+command._process_region(region, bbox, corners)
+command._process_region(region.copy(), bbox, corners)
+assert command.evaluated == 1, 'Repeated region was evaluated again'
+assert count_blobs(command.store_directory) == 1
+command._process_region(255 - region, bbox, corners)
+assert command.evaluated == 2
+assert count_blobs(command.store_directory) == 2
+print('Repeated regions are skipped and stored once')
+
+# With pre-processing, the processed region is what gets stored
+command = Counting_Command()
+command.store_directory = tempfile.mkdtemp()
+command.preprocess = {'binarize': True}
+command._process_region(region, bbox, corners)
+processed = command._get_preprocessor().process(
+    region, corners - np.array(bbox[:2]), hash_image(region))
+regions = get_store(command.store_directory).get_regions()
+assert [row[0] for row in regions] == [hash_image(processed)]
+print('Pre-processed regions are stored')